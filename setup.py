@@ -20,10 +20,23 @@ setup(name='stdcli',
           # -*- Extra requirements: -*-
       ],
       entry_points={
-        'console_scripts': [ 'stdcli_test = stdcli.stdcli_test:main', ],
+        'console_scripts': [
+            'stdcli_test = stdcli.stdcli_test:main',
+            'stdcli-complete = stdcli.completion:main',
+            'stdcli-client = stdcli.client:main',
+            ],
         'stdcli_cli_extensions': [
             'sample = stdcli.plugins.builtin:SamplePlugin',
             'dump-config = stdcli.plugins.builtin:DumpConfigPlugin',
+            'entrypoint-cache = stdcli.plugins.builtin:EntryPointCachePlugin',
+            'server = stdcli.plugins.builtin:ServerPlugin',
+            ],
+        # subcommand name -> plugin, lets --lazy-plugins import only the plugin
+        # that is needed. dump-config and server are left out on purpose, they
+        # need them all.
+        'stdcli_cli_commands': [
+            'samplecmd = stdcli.plugins.builtin:SamplePlugin',
+            'entrypoint-cache = stdcli.plugins.builtin:EntryPointCachePlugin',
             ],
         },
       )
@@ -19,9 +19,68 @@
 stdcli: sample desc here
 """
 
-import pkg_resources
-dist = pkg_resources.get_distribution(__name__)
-__VERSION__=dist.version
+class _LazyVersion(object):
+    """entrypoints.getVersion(name), looked up on first use"""
+    def __init__(self, name):
+        self._name = name
+        self._version = None
+
+    def _resolve(self):
+        if self._version is None:
+            # cached lookup, avoids importing pkg_resources at startup
+            import entrypoints
+            self._version = entrypoints.getVersion(self._name)
+        return self._version
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __eq__(self, other):
+        return self._resolve() == other
+
+    def __ne__(self, other):
+        return self._resolve() != other
+
+    def __hash__(self):
+        return hash(self._resolve())
+
+    def __add__(self, other):
+        return self._resolve() + other
+
+    def __radd__(self, other):
+        return other + self._resolve()
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+    def __str__(self):
+        return self._resolve()
+
+# importing stdcli.client or stdcli.completion must not scan sys.path
+__VERSION__ = _LazyVersion(__name__)
+
+class _LazyDistribution(object):
+    """pkg_resources.get_distribution(name), looked up on first use"""
+    def __init__(self, name):
+        self._name = name
+        self._dist = None
+
+    def _resolve(self):
+        if self._dist is None:
+            import pkg_resources
+            self._dist = pkg_resources.get_distribution(self._name)
+        return self._dist
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+    def __str__(self):
+        return str(self._resolve())
+
+dist = _LazyDistribution(__name__)
 
 
 
@@ -82,6 +82,7 @@ __all__ = [
 ]
 
 
+import bisect as _bisect
 import copy as _copy
 import os as _os
 import re as _re
@@ -90,6 +91,9 @@ import textwrap as _textwrap
 
 from gettext import gettext as _
 
+# object addresses in reprs, see ArgumentParser._get_format_key
+_address_re = _re.compile(r' at 0x[0-9a-fA-F]+')
+
 try:
     set
 except NameError:
@@ -997,6 +1001,37 @@ class _CountAction(Action):
         setattr(namespace, self.dest, new_count)
 
 
+class _IterFromFileAction(Action):
+    """Stores an iterator over the arguments, reading file references
+    (see fromfile_prefix_chars) one line at a time as it is consumed.
+    File references in its values are not expanded before parsing, see
+    ArgumentParser._expand_args_from_files for which ones those are."""
+
+    def __init__(self,
+                 option_strings,
+                 dest,
+                 nargs=ZERO_OR_MORE,
+                 default=None,
+                 required=False,
+                 help=None,
+                 metavar=None):
+        super(_IterFromFileAction, self).__init__(
+            option_strings=option_strings,
+            dest=dest,
+            nargs=nargs,
+            default=default,
+            required=required,
+            help=help,
+            metavar=metavar)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        if values is None:
+            values = []
+        elif isinstance(values, basestring):
+            values = [values]
+        setattr(namespace, self.dest, parser._iter_args_from_files(values))
+
+
 class _HelpAction(Action):
 
     def __init__(self,
@@ -1070,20 +1105,56 @@ class _SubParsersAction(Action):
             help=help,
             metavar=metavar)
 
+    class _LazyParser(object):
+
+        def __init__(self, parser_class, kwargs, setup):
+            self.parser_class = parser_class
+            self.kwargs = kwargs
+            self.setup = setup
+
+        def build(self):
+            parser = self.parser_class(**self.kwargs)
+            self.setup(parser)
+            return parser
+
     def add_parser(self, name, **kwargs):
+        kwargs, choice_action = self._get_parser_kwargs(name, kwargs)
+
+        # create the parser and add it to the map
+        parser = self._parser_class(**kwargs)
+        self._register_parser(name, parser, choice_action)
+        return parser
+
+    def add_lazy_parser(self, name, setup, **kwargs):
+        """Like add_parser(), but the parser is only created, and passed to
+        setup() to add its arguments, when it is selected."""
+        kwargs, choice_action = self._get_parser_kwargs(name, kwargs)
+        lazy_parser = self._LazyParser(self._parser_class, kwargs, setup)
+        self._register_parser(name, lazy_parser, choice_action)
+
+    def _get_parser_kwargs(self, name, kwargs):
         # set prog from the existing prefix
         if kwargs.get('prog') is None:
             kwargs['prog'] = '%s %s' % (self._prog_prefix, name)
 
         # create a pseudo-action to hold the choice help
+        choice_action = None
         if 'help' in kwargs:
             help = kwargs.pop('help')
             choice_action = self._ChoicesPseudoAction(name, help)
-            self._choices_actions.append(choice_action)
 
-        # create the parser and add it to the map
-        parser = self._parser_class(**kwargs)
+        return kwargs, choice_action
+
+    def _register_parser(self, name, parser, choice_action):
+        if choice_action is not None:
+            self._choices_actions.append(choice_action)
         self._name_parser_map[name] = parser
+
+    def _get_parser(self, name):
+        parser = self._name_parser_map[name]
+        if isinstance(parser, self._LazyParser):
+            parser = parser.build()
+            self._name_parser_map[name] = parser
         return parser
 
     def _get_subactions(self):
@@ -1098,12 +1169,11 @@ class _SubParsersAction(Action):
             setattr(namespace, self.dest, parser_name)
 
         # select the parser
-        try:
-            parser = self._name_parser_map[parser_name]
-        except KeyError:
+        if parser_name not in self._name_parser_map:
             tup = parser_name, ', '.join(self._name_parser_map)
             msg = _('unknown parser %r (choices: %s)' % tup)
             raise ArgumentError(self, msg)
+        parser = self._get_parser(parser_name)
 
         # parse all the remaining options into the namespace
         # store any unrecognized options on the object, so that the top
@@ -1213,6 +1283,7 @@ class _ActionsContainer(object):
         self.register('action', 'help', _HelpAction)
         self.register('action', 'version', _VersionAction)
         self.register('action', 'parsers', _SubParsersAction)
+        self.register('action', 'iter_fromfile', _IterFromFileAction)
 
         # raise an exception if the conflict handler is invalid
         self._get_handler()
@@ -1221,6 +1292,9 @@ class _ActionsContainer(object):
         self._actions = []
         self._option_string_actions = {}
 
+        # sorted option strings, for prefix lookups of abbreviated options
+        self._option_string_index = []
+
         # groups
         self._action_groups = []
         self._mutually_exclusive_groups = []
@@ -1327,6 +1401,8 @@ class _ActionsContainer(object):
 
         # index the action by any option strings it has
         for option_string in action.option_strings:
+            if option_string not in self._option_string_actions:
+                _bisect.insort(self._option_string_index, option_string)
             self._option_string_actions[option_string] = action
 
         # set the flag if any option strings look like negative numbers
@@ -1340,6 +1416,16 @@ class _ActionsContainer(object):
 
     def _remove_action(self, action):
         self._actions.remove(action)
+        for option_string in action.option_strings:
+            if self._option_string_actions.get(option_string) is action:
+                self._remove_option_string(option_string)
+
+    def _remove_option_string(self, option_string):
+        self._option_string_actions.pop(option_string, None)
+        index = self._option_string_index
+        i = _bisect.bisect_left(index, option_string)
+        if i < len(index) and index[i] == option_string:
+            del index[i]
 
     def _add_container_actions(self, container):
         # collect groups by titles
@@ -1473,7 +1559,7 @@ class _ActionsContainer(object):
 
             # remove the conflicting option
             action.option_strings.remove(option_string)
-            self._option_string_actions.pop(option_string, None)
+            self._remove_option_string(option_string)
 
             # if the option now has no option string, remove it from the
             # container holding it
@@ -1500,6 +1586,7 @@ class _ArgumentGroup(_ActionsContainer):
         self._registries = container._registries
         self._actions = container._actions
         self._option_string_actions = container._option_string_actions
+        self._option_string_index = container._option_string_index
         self._defaults = container._defaults
         self._has_negative_number_optionals = \
             container._has_negative_number_optionals
@@ -1597,6 +1684,15 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         self._optionals = add_group(_('optional arguments'))
         self._subparsers = None
 
+        # compiled nargs patterns, keyed on the nargs of the actions
+        self._nargs_regex_cache = {}
+
+        # last usage and help text, see _get_format_cached()
+        self._format_cache = {}
+
+        # _parse_optional() results by arg string while a parse runs
+        self._parse_optional_cache = None
+
         # register types
         def identity(string):
             return string
@@ -1732,7 +1828,14 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
 
         # parse the arguments and exit if there are any errors
         try:
-            namespace, args = self._parse_known_args(args, namespace)
+            # a parse classifies the same arg strings more than once, the
+            # option strings do not change meanwhile
+            saved_cache = self._parse_optional_cache
+            self._parse_optional_cache = {}
+            try:
+                namespace, args = self._parse_known_args(args, namespace)
+            finally:
+                self._parse_optional_cache = saved_cache
             if hasattr(namespace, _UNRECOGNIZED_ARGS_ATTR):
                 args.extend(getattr(namespace, _UNRECOGNIZED_ARGS_ATTR))
                 delattr(namespace, _UNRECOGNIZED_ARGS_ATTR)
@@ -1744,7 +1847,7 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
     def _parse_known_args(self, arg_strings, namespace):
         # replace arg strings that are file references
         if self.fromfile_prefix_chars is not None:
-            arg_strings = self._read_args_from_files(arg_strings)
+            arg_strings = self._expand_args_from_files(arg_strings)
 
         # map all mutually exclusive arguments to the other arguments
         # they can't occur with
@@ -1978,43 +2081,171 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
 
     def _read_args_from_files(self, arg_strings):
         # expand arguments referencing files
-        new_arg_strings = []
+        return list(self._iter_args_from_files(arg_strings))
+
+    def _expand_args_from_files(self, arg_strings):
+        # expand arguments referencing files, except the ones an
+        # iter_fromfile action reads as it is consumed: those among the
+        # values of its option strings or, if it is positional, in the
+        # place of its values, unless their file starts with an option.
+        # the files left unexpanded are only opened to check them.
+        iter_actions = [action for action in self._actions
+                        if isinstance(action, _IterFromFileAction)]
+        if not iter_actions:
+            return self._read_args_from_files(arg_strings)
+        slot = self._iter_positional_slot(iter_actions)
+
+        result = []
+        lazy = False
+        skip = 0
+        positionals = 0
+        only_positionals = False
+        # the arguments read from an expanded file are classified too,
+        # they are already expanded themselves
+        pending = [iter(arg_strings)]
+        while pending:
+            try:
+                arg_string = next(pending[-1])
+            except StopIteration:
+                pending.pop()
+                continue
+            is_file = len(pending) == 1 and bool(arg_string) and \
+                arg_string[0] in self.fromfile_prefix_chars
+            if is_file and not self._args_file_is_lazy(
+                    lazy or (not skip and slot is not None and
+                             positionals >= slot), arg_string):
+                pending.append(self._iter_args_from_files([arg_string]))
+                continue
+            if skip:
+                # the value of an option
+                skip -= 1
+            elif arg_string == '--' and not only_positionals:
+                only_positionals = True
+                lazy = False
+            elif not is_file and not only_positionals and \
+                    arg_string[:1] in self.prefix_chars and \
+                    arg_string != '-':
+                lazy = False
+                optional = self._parse_optional(arg_string)
+                if optional is not None and optional[0] is not None:
+                    action, option_string, explicit_arg = optional
+                    if isinstance(action, _IterFromFileAction):
+                        lazy = explicit_arg is None
+                        if explicit_arg is not None and explicit_arg[:1] and \
+                                explicit_arg[0] in self.fromfile_prefix_chars:
+                            self._check_args_file(explicit_arg)
+                    elif explicit_arg is None:
+                        if action.nargs is None:
+                            skip = 1
+                        elif isinstance(action.nargs, int):
+                            skip = action.nargs
+            elif not lazy:
+                positionals += 1
+            result.append(arg_string)
+        return result
+
+    def _iter_positional_slot(self, iter_actions):
+        # how many positional arguments come before the values of the
+        # positional iter_fromfile action, None if there is none or it
+        # depends on the arguments
+        count = 0
+        for action in self._get_positional_actions():
+            if action in iter_actions:
+                return count
+            if action.nargs is None:
+                count += 1
+            elif isinstance(action.nargs, int):
+                count += action.nargs
+            else:
+                return None
+        return None
+
+    def _args_file_is_lazy(self, in_place, arg_string):
+        # a file reference in the place of iter_fromfile values is left
+        # for the action, after checking it can be read
+        if not in_place or self._args_file_starts_with_option(arg_string):
+            return False
+        self._check_args_file(arg_string)
+        return True
+
+    def _check_args_file(self, arg_string):
+        try:
+            open(arg_string[1:], 'rU').close()
+        except IOError:
+            err = _sys.exc_info()[1]
+            self.error(str(err))
+
+    def _args_file_starts_with_option(self, arg_string):
+        # whether the first argument in the file looks like an option
+        try:
+            args_file = open(arg_string[1:], 'rU')
+        except IOError:
+            err = _sys.exc_info()[1]
+            self.error(str(err))
+        try:
+            for arg in self._iter_args_file_lines(args_file):
+                return arg[:1] in self.prefix_chars and arg not in ('', '-')
+            return False
+        finally:
+            args_file.close()
+
+    def _iter_args_from_files(self, arg_strings, including=()):
+        # expand arguments referencing files without reading the files
+        # into memory. including holds the files currently being read,
+        # so a file that references itself is an error, not a loop.
         for arg_string in arg_strings:
 
-            # for regular arguments, just add them back into the list
-            if arg_string[0] not in self.fromfile_prefix_chars:
-                new_arg_strings.append(arg_string)
+            # for regular arguments, just pass them through
+            if not arg_string or \
+               arg_string[0] not in self.fromfile_prefix_chars:
+                yield arg_string
+                continue
 
             # replace arguments referencing files with the file content
-            else:
-                try:
-                    args_file = open(arg_string[1:])
-                    try:
-                        arg_strings = []
-                        for arg_line in args_file.read().splitlines():
-                            for arg in self.convert_arg_line_to_args(arg_line):
-                                arg_strings.append(arg)
-                        arg_strings = self._read_args_from_files(arg_strings)
-                        new_arg_strings.extend(arg_strings)
-                    finally:
-                        args_file.close()
-                except IOError:
-                    err = _sys.exc_info()[1]
-                    self.error(str(err))
-
-        # return the modified argument list
-        return new_arg_strings
+            filename = arg_string[1:]
+            path = _os.path.realpath(filename)
+            if path in including:
+                self.error(_('recursive argument file: %s') % filename)
+            try:
+                args_file = open(filename, 'rU')
+            except IOError:
+                err = _sys.exc_info()[1]
+                self.error(str(err))
+            try:
+                file_args = self._iter_args_file_lines(args_file)
+                for arg in self._iter_args_from_files(file_args,
+                                                      including + (path,)):
+                    yield arg
+            finally:
+                args_file.close()
+
+    def _iter_args_file_lines(self, args_file):
+        try:
+            for arg_line in args_file:
+                if arg_line.endswith('\n'):
+                    arg_line = arg_line[:-1]
+                for arg in self.convert_arg_line_to_args(arg_line):
+                    yield arg
+        except IOError:
+            err = _sys.exc_info()[1]
+            self.error(str(err))
 
     def convert_arg_line_to_args(self, arg_line):
         return [arg_line]
 
     def _match_argument(self, action, arg_strings_pattern):
         # match the pattern for this action to the arg strings
-        nargs_pattern = self._get_nargs_pattern(action)
-        match = _re.match(nargs_pattern, arg_strings_pattern)
+        if action.option_strings:
+            arg_count = self._match_optional_nargs(action.nargs,
+                                                   arg_strings_pattern)
+        else:
+            arg_count = None
+            match = self._get_nargs_regex([action]).match(arg_strings_pattern)
+            if match is not None:
+                arg_count = len(match.group(1))
 
         # raise an exception if we weren't able to find a match
-        if match is None:
+        if arg_count is None:
             nargs_errors = {
                 None: _('expected one argument'),
                 OPTIONAL: _('expected at most one argument'),
@@ -2025,7 +2256,46 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             raise ArgumentError(action, msg)
 
         # return the number of arguments matched
-        return len(match.group(1))
+        return arg_count
+
+    def _match_optional_nargs(self, nargs, arg_strings_pattern):
+        # the nargs patterns of optionals have no '-*', so they are a
+        # greedy match of the leading 'A's (or 'A's and 'O's)
+        if nargs in (REMAINDER, PARSER):
+            chars = 'AO'
+        else:
+            chars = 'A'
+        count = 0
+        for char in arg_strings_pattern:
+            if char not in chars:
+                break
+            count += 1
+
+        if nargs is None:
+            return count and 1 or None
+        elif nargs == OPTIONAL:
+            return min(count, 1)
+        elif nargs in (ZERO_OR_MORE, REMAINDER):
+            return count
+        elif nargs == ONE_OR_MORE:
+            return count or None
+        elif nargs == PARSER:
+            if arg_strings_pattern[:1] != 'A':
+                return None
+            return count
+        elif count >= nargs:
+            return nargs
+        return None
+
+    def _get_nargs_regex(self, actions):
+        key = tuple([(action.nargs, bool(action.option_strings))
+                     for action in actions])
+        regex = self._nargs_regex_cache.get(key)
+        if regex is None:
+            pattern = ''.join([self._get_nargs_pattern(action)
+                               for action in actions])
+            regex = self._nargs_regex_cache[key] = _re.compile(pattern)
+        return regex
 
     def _match_arguments_partial(self, actions, arg_strings_pattern):
         # progressively shorten the actions list by slicing off the
@@ -2033,9 +2303,8 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         result = []
         for i in range(len(actions), 0, -1):
             actions_slice = actions[:i]
-            pattern = ''.join([self._get_nargs_pattern(action)
-                               for action in actions_slice])
-            match = _re.match(pattern, arg_strings_pattern)
+            match = self._get_nargs_regex(actions_slice).match(
+                arg_strings_pattern)
             if match is not None:
                 result.extend([len(string) for string in match.groups()])
                 break
@@ -2044,6 +2313,16 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         return result
 
     def _parse_optional(self, arg_string):
+        cache = self._parse_optional_cache
+        if cache is None:
+            return self._parse_optional_uncached(arg_string)
+        if arg_string in cache:
+            return cache[arg_string]
+        result = self._parse_optional_uncached(arg_string)
+        cache[arg_string] = result
+        return result
+
+    def _parse_optional_uncached(self, arg_string):
         # if it's an empty string, it was meant to be a positional
         if not arg_string:
             return None
@@ -2112,11 +2391,10 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             else:
                 option_prefix = option_string
                 explicit_arg = None
-            for option_string in self._option_string_actions:
-                if option_string.startswith(option_prefix):
-                    action = self._option_string_actions[option_string]
-                    tup = action, option_string, explicit_arg
-                    result.append(tup)
+            for option_string in self._iter_option_prefix(option_prefix):
+                action = self._option_string_actions[option_string]
+                tup = action, option_string, explicit_arg
+                result.append(tup)
 
         # single character options can be concatenated with their arguments
         # but multiple character options always have to have their argument
@@ -2127,12 +2405,12 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             short_option_prefix = option_string[:2]
             short_explicit_arg = option_string[2:]
 
-            for option_string in self._option_string_actions:
-                if option_string == short_option_prefix:
-                    action = self._option_string_actions[option_string]
-                    tup = action, option_string, short_explicit_arg
-                    result.append(tup)
-                elif option_string.startswith(option_prefix):
+            if short_option_prefix in self._option_string_actions:
+                action = self._option_string_actions[short_option_prefix]
+                tup = action, short_option_prefix, short_explicit_arg
+                result.append(tup)
+            for option_string in self._iter_option_prefix(option_prefix):
+                if option_string != short_option_prefix:
                     action = self._option_string_actions[option_string]
                     tup = action, option_string, explicit_arg
                     result.append(tup)
@@ -2144,6 +2422,14 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         # return the collected option tuples
         return result
 
+    def _iter_option_prefix(self, option_prefix):
+        # option strings with this prefix are adjacent in the sorted index
+        index = self._option_string_index
+        i = _bisect.bisect_left(index, option_prefix)
+        while i < len(index) and index[i].startswith(option_prefix):
+            yield index[i]
+            i += 1
+
     def _get_nargs_pattern(self, action):
         # in all examples below, we have to allow for '--' args
         # which are represented as '-' in the pattern
@@ -2273,12 +2559,65 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
     # Help-formatting methods
     # =======================
     def format_usage(self):
+        return self._get_format_cached('usage', self._render_usage)
+
+    def format_help(self):
+        return self._get_format_cached('help', self._render_help)
+
+    def _get_format_cached(self, kind, format_func):
+        # formatting wraps and regex-splits every action, so keep the last
+        # text of each kind for as long as the parser and width stay the
+        # same. _format_cache may be replaced by anything with get() and
+        # item assignment, to keep the text between runs.
+        key = self._get_format_key()
+        cached = self._format_cache.get(kind)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        text = format_func()
+        self._format_cache[kind] = key, text
+        return text
+
+    def _get_format_key(self):
+        # everything the help text is made of, as a string so it can be
+        # compared with a key saved by another process
+        positions = {}
+        actions = []
+        for action in self._actions:
+            positions[id(action)] = len(actions)
+            choices = action.choices
+            if choices is not None:
+                choices = list(choices)
+            get_subactions = getattr(action, '_get_subactions', list)
+            subactions = [(subaction.dest, subaction.help)
+                          for subaction in get_subactions()]
+            actions.append((action.__class__.__name__, action.option_strings,
+                            action.dest, action.nargs, action.metavar,
+                            action.help, action.default, action.required,
+                            choices, subactions))
+        groups = []
+        for group in self._action_groups + self._mutually_exclusive_groups:
+            groups.append((getattr(group, 'title', None),
+                           getattr(group, 'description', None),
+                           [positions[id(action)]
+                            for action in group._group_actions]))
+        formatter_class = '%s.%s' % (self.formatter_class.__module__,
+                                     self.formatter_class.__name__)
+        # the locale picks the gettext translation of argparse's own strings
+        locale = [_os.environ.get(name) for name in
+                  ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG')]
+        key = repr((_os.environ.get('COLUMNS'), locale, formatter_class,
+                    self.prog, self.usage, self.description, self.epilog,
+                    actions, groups))
+        # a default like <object at 0x...> would change the key every run
+        return _address_re.sub(' at 0x?', key)
+
+    def _render_usage(self):
         formatter = self._get_formatter()
         formatter.add_usage(self.usage, self._actions,
                             self._mutually_exclusive_groups)
         return formatter.format_help()
 
-    def format_help(self):
+    def _render_help(self):
         formatter = self._get_formatter()
 
         # usage
@@ -25,7 +25,10 @@ Command line interface class and related.
 
 import os
 import sys
+import copy
+import errno
 import time
+import atexit
 import fcntl
 import signal
 import locale
@@ -33,11 +36,21 @@ import logging
 import logging.config
 import argparse
 import ConfigParser
-import pkg_resources
+import json
+import pkgutil
 from cStringIO import StringIO
 
-from trace_decorator import traceLog, getLog
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from trace_decorator import traceLog, getLog, invalidateLogCache, refreshTraceEnabled, retraceModules, setTraceReprLimits, setTraceSampling, parseTraceSample, enableProfiling, formatProfile
 import plugin
+import log_handlers
+import entrypoints
+import completion
+import config_cache
 
 
 import stdcli
@@ -56,6 +69,114 @@ def path_expand(x):
     if x is not None:
         return os.path.realpath( os.path.expandvars( os.path.expanduser( x )))
 
+# "10M", "512k" or plain bytes
+def byte_size(x):
+    x = x.strip()
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    if x[-1:].lower() in units:
+        return int(float(x[:-1]) * units[x[-1:].lower()])
+    return int(x)
+
+# "30s", "15m", "12h", "1d" or plain seconds
+def duration(x):
+    x = x.strip()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if x[-1:].lower() in units:
+        return float(x[:-1]) * units[x[-1:].lower()]
+    return float(x)
+
+def trace_sample(x):
+    parseTraceSample(x)
+    return x.strip()
+
+# subcommand name in argv left over after the global options, or None if
+# there is none or full --help was requested before it
+def findCommandName(args):
+    args = iter(args)
+    for arg in args:
+        if arg in ("-h", "--help"):
+            return None
+        if arg == "--":
+            return next(args, None)
+        if not arg.startswith("-"):
+            return arg
+    return None
+
+# pull the given actions out of args without parsing the rest. returns
+# [(action, option_string, values)] in command line order and the args that
+# are left. the actions must take no value or a single one.
+def preScan(parser, args, actions):
+    found = []
+    remaining = []
+    args = iter(args)
+    for arg in args:
+        if arg == "--":
+            remaining.append(arg)
+            remaining.extend(args)
+            break
+        optional = parser._parse_optional(arg)
+        if optional is None or optional[0] not in actions:
+            remaining.append(arg)
+            continue
+        action, option_string, explicit_arg = optional
+        arg_strings = []
+        if action.nargs == 0:
+            if explicit_arg is not None:
+                # let the full parse report it
+                remaining.append(arg)
+                continue
+        elif explicit_arg is not None:
+            arg_strings = [explicit_arg]
+        else:
+            value = next(args, None)
+            if value is None or value == "--" or parser._parse_optional(value) is not None:
+                parser.error(str(argparse.ArgumentError(action, _("expected one argument"))))
+            arg_strings = [value]
+        try:
+            found.append((action, option_string, parser._get_values(action, arg_strings)))
+        except argparse.ArgumentError, e:
+            parser.error(str(e))
+    return found, remaining
+
+# fcntl.lockf() fd, blocking until the lock is free or timeout seconds have
+# passed, then IOError EAGAIN like a failed non-blocking attempt
+def waitForLock(fd, timeout=None):
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+        # SIGALRM interrupts the wait, unless someone else is using it
+        try:
+            if signal.getitimer(signal.ITIMER_REAL) != (0.0, 0.0):
+                return _pollForLock(fd, deadline)
+            old_handler = signal.signal(signal.SIGALRM, lambda signum, frame: None)
+        except ValueError:
+            # not the main thread
+            return _pollForLock(fd, deadline)
+        # repeating, it may fire before lockf() blocks
+        signal.setitimer(signal.ITIMER_REAL, max(timeout, 0.001), 0.1)
+    try:
+        while True:
+            try:
+                return fcntl.lockf(fd, fcntl.LOCK_EX)
+            except IOError, e:
+                if e.errno != errno.EINTR:
+                    raise
+            if deadline is not None and time.time() >= deadline:
+                raise IOError(errno.EAGAIN, "timed out waiting for lock")
+    finally:
+        if deadline is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old_handler)
+
+def _pollForLock(fd, deadline):
+    while True:
+        try:
+            return fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES) or time.time() >= deadline:
+                raise
+        time.sleep(0.1)
+
 # only use this function prior to logging availability
 def exFatal(message):
     print >> sys.stderr, message
@@ -65,10 +186,15 @@ def sigquit(signum, frame):
     """ SIGQUIT handler for the cli. """
     exFatal(_("QUIT signal caught - exiting immediately"))
 
+_terminated = False
+
 def sigterm(signum, frame):
-    """ SIGQUIT handler for the cli. """
-    moduleLog.info(_("TERM signal caught - exiting immediately"))
-    sys.exit()
+    """ SIGTERM handler for the cli. """
+    # no logging here, the interrupted code may hold the lock of a log
+    # queue. main() logs and flushes on the way out.
+    global _terminated
+    _terminated = True
+    log_handlers.exitWhenSafe()
 
 # for python trace support
 def setDebug(*args, **kargs):
@@ -106,15 +232,21 @@ def main():
 
     ctx.retcode = 0
     try:
-        ctx.doCommands()
-        moduleVerboseLog.info(_('Complete!'))
-    except KeyboardInterrupt:
-        moduleLog.critical(_('Exiting on user <CTRL>-C keypress'))
-        if ctx.retcode == 0:
-            ctx.retcode = 1
-    except (Exception,), e:
-        if ctx.retcode == 0:
-            ctx.retcode = 1
+        try:
+            ctx.doCommands()
+            moduleVerboseLog.info(_('Complete!'))
+        except KeyboardInterrupt:
+            moduleLog.critical(_('Exiting on user <CTRL>-C keypress'))
+            if ctx.retcode == 0:
+                ctx.retcode = 1
+        except (Exception,), e:
+            if ctx.retcode == 0:
+                ctx.retcode = 1
+    finally:
+        log_handlers.exitDone()
+        if _terminated:
+            moduleLog.info(_("TERM signal caught - exiting immediately"))
+        log_handlers.flushLogs()
 
     sys.exit(ctx.retcode)
 
@@ -131,81 +263,278 @@ def setArgDefaults(namespace, conf, args_from_config):
                     exFatal(configParseError % {"section": section, "option": option, "value": conf.get(section, option), "error": str(e)})
                 continue
 
+# set up logging from the config files already read into conf, as
+# logging.config.fileConfig() would from a file: [formatters], [handlers],
+# [loggers] and their sections. a "dictconfig" option in [logging] holding
+# a logging.config.dictConfig() dict as JSON is used instead if present.
+# returns False if conf has no logging config.
+def configureLogging(conf, disable_existing_loggers=True):
+    if conf.has_option("logging", "dictconfig"):
+        config = _strings(json.loads(conf.get("logging", "dictconfig", raw=True)))
+        if not disable_existing_loggers:
+            config["disable_existing_loggers"] = False
+        logging.config.dictConfig(config)
+        return True
+    try:
+        formatters = logging.config._create_formatters(conf)
+        logging._acquireLock()
+        try:
+            logging._handlers.clear()
+            del logging._handlerList[:]
+            handlers = logging.config._install_handlers(conf, formatters)
+            logging.config._install_loggers(conf, handlers, disable_existing_loggers)
+        finally:
+            logging._releaseLock()
+    except (ConfigParser.NoSectionError,), e:
+        return False
+    return True
+
+# detach every handler so logging can be set up again, eg. in a forked
+# child. the handlers are not closed, the parent still uses them.
+def resetLogging():
+    loggers = [logging.getLogger()] + [ l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger) ]
+    for logger in loggers:
+        for hdlr in logger.handlers[:]:
+            logger.removeHandler(hdlr)
+    invalidateLogCache()
+
+def _strings(value):
+    # json gives unicode, logging wants str
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, dict):
+        return dict([ (_strings(k), _strings(v)) for k, v in value.items() ])
+    if isinstance(value, list):
+        return [ _strings(v) for v in value ]
+    return value
+
+
+class HelpTextCache(dict):
+    """
+    ArgumentParser._format_cache that is also kept on disk next to the
+    entry point cache, so --help and usage errors are not formatted again
+    on every run. The file is only read when help text is needed.
+    """
+    def __init__(self, filename):
+        dict.__init__(self)
+        self.filename = filename
+        self.loaded = False
+
+    def get(self, kind, default=None):
+        if not self.loaded:
+            self.loaded = True
+            try:
+                fd = open(self.filename)
+                try:
+                    for k, (key, text) in json.load(fd).items():
+                        dict.__setitem__(self, str(k), (key.encode("utf-8"), text.encode("utf-8")))
+                finally:
+                    fd.close()
+            except (IOError, OSError, ValueError, TypeError, AttributeError):
+                pass
+        return dict.get(self, kind, default)
+
+    def __setitem__(self, kind, value):
+        dict.__setitem__(self, kind, value)
+        entrypoints.writeCacheFile(self.filename, dict(self))
+
 
 class BaseContext(object):
     def __init__(self,prog=moduleName, args=[]):
+        # (phase, seconds) for each startup step, see test/benchStartup.py
+        self.timings = []
+        self._phase_start = time.time()
+
         # default cli namespace and program defaults
         self.args = argparse.Namespace()
-        self.args.config_files = [StringIO(pkg_resources.resource_string(moduleName,"%s.ini" % moduleName)),]
+        self.args.config_files = [StringIO(pkgutil.get_data(moduleName,"%s.ini" % moduleName)),]
         self.args.uid = os.geteuid()
         self.runLock = None
 
-        # setup argument parser and config files
-        base_parser = argparse.ArgumentParser(add_help=False)
-        self.conf = ConfigParser.ConfigParser()
+        # one parser for all global options. the options that affect which
+        # config files are read are picked out of argv by a pre-scan, the rest
+        # is parsed once after reading the config so config values are the
+        # defaults. the parser caches how each arg string was classified, so
+        # the later passes do not redo that work.
+        self.parser = p = argparse.ArgumentParser(add_help=False)
+
+        config_actions = [
+            p.add_argument("--no-default-config", dest="config_files", action="store_const", const=[], help=_("Dont read default config files.")),
+            p.add_argument("-c", "--config", dest="config_files", action="append", default=None, metavar="FILENAME", help=_("Add additional config to read.")),
+            p.add_argument('--version', action='version', version='%(prog)s ' + __VERSION__),
+            ]
+        p.add_argument("-v", "--verbose", action="count", dest="verbosity", help=_("Display more verbose output."))
+        p.add_argument("-q", "--quiet", action="store_const", const=0, dest="verbosity", help=_("Minimize program output. Only errors and warnings are displayed."))
+        p.add_argument("--debug", action="append", dest="debug", default=[], help=_("Enable a debugging flag."))
+        p.add_argument("--trace", action="store_true", dest="trace", help=_("Enable verbose function tracing."))
+        p.add_argument("--trace-off", action="store_false", dest="trace", help=_("Disable verbose function tracing."))
+        p.add_argument("--trace-sample", action="store", dest="trace_sample", type=trace_sample, metavar="N|K/s", help=_("Only trace one call in N, or at most K calls per second, of each function."))
+        p.add_argument("--trace-profile", action="store", dest="trace_profile", choices=["table", "json"], help=_("Collect per-function call timings and print them as a table or JSON at exit or on SIGUSR2."))
+        p.add_argument("--trace-profile-file", action="store", dest="trace_profile_file", metavar="FILENAME", help=_("Append the --trace-profile report to this file instead of stderr."))
+        p.add_argument("--trace-json-file", action="store", dest="trace_json_file", metavar="FILENAME", help=_("Write function trace records to this file as JSON lines."))
+        p.add_argument("--trace-module", action="append", dest="trace_modules", default=[], metavar="MODULE_NAME_GLOB", help=_("Restore function tracing for matching modules when running with STDCLI_NO_TRACE=1."))
+        p.add_argument("--logfile", action="store", dest="logfile", help=_("Specify a file to log all operations to"))
+        p.add_argument("--async-logging", action="store_true", dest="async_logging", help=_("Write log output from a background thread."))
+        p.add_argument("--no-async-logging", action="store_false", dest="async_logging", help=_("Write log output as it is logged."))
+        p.add_argument("--lockfile", action="store", dest="lockfile", help=_("Specify the lock file."))
+        p.add_argument("--lock-timeout", action="store", dest="lock_timeout", type=duration, metavar="SECONDS", help=_("Give up waiting for the lock after this long."))
+        p.add_argument("--reset-disabled-plugin-list", action="store_const", const=[], dest="disabled_plugins", metavar="PLUGIN_NAME_GLOB", help=_("Disable single named plugin."))
+        p.add_argument("--disable-plugin", action="append", dest="disabled_plugins", metavar="PLUGIN_NAME_GLOB", help=_("Disable single named plugin."))
+        p.add_argument("--skip-import-errors", action="store_true", dest="skip_import_errors", help=_("Disable plugins with module load errors."))
+        p.add_argument("--lazy-plugins", action="store_true", dest="lazy_plugins", help=_("Only load the plugin providing the requested command."))
+        p.add_argument("--no-lazy-plugins", action="store_false", dest="lazy_plugins", help=_("Load all plugins."))
+        p.add_argument("--parallel-plugins", action="store", dest="parallel_plugins", type=int, metavar="THREADS", help=_("Initialize plugins that do not depend on each other on this many threads."))
 
-        # base config options that we have to parse first, related to config files
-        base_parser.add_argument("--no-default-config", dest="config_files", action="store_const", const=[], help=_("Dont read default config files."))
-        base_parser.add_argument("-c", "--config", dest="config_files", action="append", default=None, metavar="FILENAME", help=_("Add additional config to read."))
-        base_parser.add_argument('--version', action='version', version='%(prog)s ' + __VERSION__)
-        self.args, remaining_args = base_parser.parse_known_args(args, namespace=self.args)
+        self._config_actions = config_actions
+        found, args = preScan(p, args, config_actions)
+        for action, option_string, values in found:
+            action(p, self.args, values, option_string)
+        self._endPhase("prescan")
 
-        # actually read all the config file specified
-        for fn in self.args.config_files:
-            if hasattr(fn, "readline"):
-                self.conf.readfp(fn)
-            else:
-                self.conf.read(fn)
+        # actually read all the config file specified, or the cached result
+        # of reading them if none changed
+        self.conf = config_cache.readConfig(self.args.config_files, moduleName)
 
         # argument parse.  command line overrides config file which overrides built-in default
         args_from_config = [
             # argname, default, config file section, config file option, transform
             ("verbosity", 1, "general", None, lambda x: int(x)),
             ("trace", False, "general", None, lambda x: bool(int(x))),
+            ("trace_sample", None, "general", None, trace_sample),
+            ("trace_profile", None, "general", None, lambda x: x.strip() or None),
+            ("trace_profile_file", None, "general", None, path_expand,),
+            ("trace_json_file", None, "general", None, path_expand,),
+            ("trace_maxlevel", None, "general", None, lambda x: int(x)),
+            ("trace_maxlength", None, "general", None, lambda x: int(x)),
             ("lockfile", None, "general", None, path_expand,),
+            ("lock_timeout", None, "general", None, duration),
             ("disabled_plugins", [], "general", None, lambda x: [y.strip() for y in x.split(",") if y.strip()]),
             ("skip_import_errors", False, "general", None, lambda x: bool(int(x))),
+            ("lazy_plugins", False, "general", None, lambda x: bool(int(x))),
+            ("parallel_plugins", 0, "general", None, lambda x: int(x)),
+            ("async_logging", False, "general", None, lambda x: bool(int(x))),
+            ("logfile_buffer_size", 0, "general", None, byte_size),
+            ("logfile_flush_interval", 1.0, "general", None, duration),
+            ("logfile_max_bytes", 0, "general", None, byte_size),
+            ("logfile_rotate_interval", 0, "general", None, duration),
+            ("logfile_backups", 5, "general", None, lambda x: int(x)),
+            ("logfile_compress", False, "general", None, lambda x: bool(int(x))),
             ]
 
         setArgDefaults(self.args, self.conf, args_from_config)
+        self._config_args = copy.copy(self.args)
+        self._endPhase("read_config")
 
-        # more CLI parsing
-        self.parser = p = argparse.ArgumentParser(add_help=False, parents=[base_parser])
-        p.add_argument("-v", "--verbose", action="count", dest="verbosity", help=_("Display more verbose output."))
-        p.add_argument("-q", "--quiet", action="store_const", const=0, dest="verbosity", help=_("Minimize program output. Only errors and warnings are displayed."))
-        p.add_argument("--debug", action="append", dest="debug", default=[], help=_("Enable a debugging flag."))
-        p.add_argument("--trace", action="store_true", dest="trace", help=_("Enable verbose function tracing."))
-        p.add_argument("--trace-off", action="store_false", dest="trace", help=_("Disable verbose function tracing."))
-        p.add_argument("--logfile", action="store", dest="logfile", help=_("Specify a file to log all operations to"))
-        p.add_argument("--lockfile", action="store", dest="lockfile", help=_("Specify the lock file."))
-        p.add_argument("--reset-disabled-plugin-list", action="store_const", const=[], dest="disabled_plugins", metavar="PLUGIN_NAME_GLOB", help=_("Disable single named plugin."))
-        p.add_argument("--disable-plugin", action="append", dest="disabled_plugins", metavar="PLUGIN_NAME_GLOB", help=_("Disable single named plugin."))
-        p.add_argument("--skip-import-errors", action="store_true", dest="skip_import_errors", help=_("Disable plugins with module load errors."))
         self.args, remaining_args = p.parse_known_args(args, namespace=self.args)
+        self._endPhase("parse_global")
 
         self.args.lockfile = path_expand(self.args.lockfile)
 
-        self.setupLogging(configFile=self.args.config_files[0], verbosity=self.args.verbosity, trace=self.args.trace, debug=self.args.debug)
+        setTraceReprLimits(maxlevel=self.args.trace_maxlevel, maxlength=self.args.trace_maxlength)
+        setTraceSampling(*parseTraceSample(self.args.trace_sample))
+        self.args.trace_profile_file = path_expand(self.args.trace_profile_file)
+        self.args.trace_json_file = path_expand(self.args.trace_json_file)
+        if self.args.trace_profile:
+            enableProfiling()
+            atexit.register(self.dumpProfile)
+            signal.signal(signal.SIGUSR2, self.dumpProfile)
+        self.setupLogging(self.conf, verbosity=self.args.verbosity, trace=self.args.trace, debug=self.args.debug)
+        self._logging_args = self._loggingArgs()
+        self._endPhase("setup_logging")
 
         # parent subparsers for plugins to add cmds to
+        self._global_actions = list(p._actions)
+        self._global_parser = None
         self.subparsers = p.add_subparsers(help="%s commands" % moduleName, dest="command_name")
 
         self.plugins = plugin.PluginContainer(disable=self.args.disabled_plugins, skip_import_errors=self.args.skip_import_errors)
-        self.plugins.loadPlugins("%s_cli_extensions" % moduleName)
-        self.plugins.instantiatePlugins("%s_cli_extensions" % moduleName, self)
-
-        # final cli parsing. make new parser so we have a --help option. we dont want --help eaten too early or user
+        only = None
+        if self.args.lazy_plugins:
+            only = self.plugins.commandPlugins("%s_cli_extensions" % moduleName, "%s_cli_commands" % moduleName, findCommandName(remaining_args))
+        self.plugins.loadPlugins("%s_cli_extensions" % moduleName, only=only)
+        retraceModules(*self.args.trace_modules)
+        self._endPhase("load_plugins")
+        if self.args.parallel_plugins > 1:
+            self.plugins.instantiatePluginsParallel("%s_cli_extensions" % moduleName, self.args.parallel_plugins, self)
+        else:
+            self.plugins.instantiatePlugins("%s_cli_extensions" % moduleName, self)
+        self._endPhase("instantiate_plugins")
+
+        # final cli parsing. --help is only added now, we dont want --help eaten too early or user
         # wont get full CLI help
-        self.final_parser = argparse.ArgumentParser(parents=[self.parser])
-        self.final_parser.parse_args(remaining_args, namespace=self.args)
+        p.add_argument("-h", "--help", action="help", help=_("show this help message and exit"))
+        if entrypoints.cacheEnabled():
+            p._format_cache = HelpTextCache(entrypoints.cacheFile("help-%s" % moduleName))
+            if not self.args.lazy_plugins:
+                self.updateCompletionIndex()
+        self.final_parser = p
+        p.parse_args(remaining_args, namespace=self.args)
+        self._endPhase("parse_final")
 
         for p in self.plugins.eachInstantiatedPlugin("%s_cli_extensions" % moduleName): p.finishedCliParsing(self)
 
-    def setupLogging(self, configFile, verbosity=1, trace=0, debug=0):
+    def parseCommand(self, args):
+        """
+        Parse args for another command run with this context, as if the
+        program had been started with them (see stdcli.server). Config
+        files, plugins and --trace-profile stay as they were set up at
+        startup. Logging is set up again if the options for it differ,
+        so this must run in a child forked for the command.
+        """
+        p = self.parser
+        self.args = copy.copy(self._config_args)
+        found, args = preScan(p, args, self._config_actions)
+        for action, option_string, values in found:
+            if action.dest == "config_files":
+                p.error(_("argument %s: config files can only be given at startup") % option_string)
+            action(p, self.args, values, option_string)
+
+        # the global options, without the subcommands, like at startup
+        if self._global_parser is None:
+            self._global_parser = argparse.ArgumentParser(prog=p.prog, add_help=False)
+            for action in self._global_actions:
+                self._global_parser._add_action(action)
+        self.args, remaining_args = self._global_parser.parse_known_args(args, namespace=self.args)
+        self.args.lockfile = path_expand(self.args.lockfile)
+
+        if self.args.trace_profile != self._config_args.trace_profile:
+            p.error(_("argument --trace-profile: can only be given at startup"))
+        setTraceSampling(*parseTraceSample(self.args.trace_sample))
+        self.args.trace_profile_file = path_expand(self.args.trace_profile_file)
+        self.args.trace_json_file = path_expand(self.args.trace_json_file)
+        if self._loggingArgs() != self._logging_args:
+            # loggers keep the state startup left them in, configuring
+            # again must not disable the ones created since
+            loggers = [ l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger) ]
+            disabled = [ (l, l.disabled) for l in loggers ]
+            resetLogging()
+            self.setupLogging(self.conf, verbosity=self.args.verbosity, trace=self.args.trace, debug=self.args.debug, disable_existing_loggers=False)
+            for logger, state in disabled:
+                logger.disabled = state
+            refreshTraceEnabled()
+            self._logging_args = self._loggingArgs()
+
+        p.parse_args(remaining_args, namespace=self.args)
+        for plug in self.plugins.eachInstantiatedPlugin("%s_cli_extensions" % moduleName): plug.finishedCliParsing(self)
+
+    def _loggingArgs(self):
+        # the options setupLogging() depends on
+        return [ getattr(self.args, name) for name in ("verbosity", "trace", "debug", "logfile", "trace_json_file", "async_logging") ]
+
+    def updateCompletionIndex(self):
+        # the parser tree only changes with the installed and disabled plugins
+        key = repr((__VERSION__, entrypoints.getIndex()["fingerprint"], sorted(self.args.disabled_plugins)))
+        key = md5(key).hexdigest()
+        completion.updateIndex(self.parser, completion.indexFile(moduleName), key)
+
+    def _endPhase(self, phase):
+        now = time.time()
+        self.timings.append((phase, now - self._phase_start))
+        self._phase_start = now
+
+    def setupLogging(self, conf, verbosity=1, trace=0, debug=0, disable_existing_loggers=True):
         # set up logging
-        try:
-            logging.config.fileConfig(configFile)
-        except (ConfigParser.NoSectionError,), e:
+        if not configureLogging(conf, disable_existing_loggers):
             # manually set up basic logging if not present in cfg file
             root_log = logging.getLogger()
             root_log.setLevel(logging.NOTSET)
@@ -215,6 +544,14 @@ class BaseContext(object):
             hdlr.setFormatter(formatter)
             root_log.addHandler(hdlr)
 
+        # configureLogging() strips handlers from existing loggers, re-resolve them
+        invalidateLogCache()
+
+        # it also disables them, not the ones getLog() gives out though
+        for name, logger in logging.Logger.manager.loggerDict.items():
+            if isinstance(logger, logging.Logger) and name.split(".")[0] in ("trace", "verbose", "debug", "stdcli", moduleName):
+                logger.disabled = 0
+
         root_log        = logging.getLogger()
         module_log         = logging.getLogger(moduleName)
         module_debug_log   = logging.getLogger("debug")
@@ -224,7 +561,13 @@ class BaseContext(object):
         # if logfile is specified, it will get everything
         root_log_hdlr = None
         if self.args.logfile:
-            root_log_hdlr = logging.FileHandler(self.args.logfile)
+            root_log_hdlr = log_handlers.LogFileHandler(self.args.logfile,
+                buffer_size=self.args.logfile_buffer_size,
+                flush_interval=self.args.logfile_flush_interval,
+                max_bytes=self.args.logfile_max_bytes,
+                rotate_interval=self.args.logfile_rotate_interval,
+                backups=self.args.logfile_backups,
+                compress=self.args.logfile_compress)
             root_log.addHandler(root_log_hdlr)
 
         module_log.propagate = 0
@@ -240,6 +583,10 @@ class BaseContext(object):
         if trace:
             module_trace_log.propagate = 1
 
+        # structured trace records are written from a background thread
+        if self.args.trace_json_file:
+            module_trace_log.addHandler(log_handlers.JsonTraceHandler(self.args.trace_json_file))
+
         # verbose stuff always goes to logfile if configured
         if verbosity >= 1:
             module_log.propagate = 1
@@ -255,10 +602,30 @@ class BaseContext(object):
             for hdlr in root_log.handlers:
                 hdlr.setLevel(logging.DEBUG)
 
+        # last, the handlers are final now. logging.shutdown() at exit
+        # writes what is still queued, see log_handlers.flushLogs() for
+        # other ways out.
+        if self.args.async_logging:
+            loggers = [root_log] + [ l for l in logging.Logger.manager.loggerDict.values() if isinstance(l, logging.Logger) and l.handlers ]
+            log_handlers.makeAsync(loggers)
+
+        # let traceLog() wrappers skip all work when trace output goes nowhere
+        refreshTraceEnabled()
 
 
+    def dumpProfile(self, *args):
+        report = formatProfile(self.args.trace_profile)
+        if self.args.trace_profile_file:
+            fd = open(self.args.trace_profile_file, "a")
+            fd.write(report)
+            fd.close()
+        else:
+            sys.stderr.write(report)
+
     @traceLog()
-    def lock(self):
+    def lock(self, wait=False, timeout=None):
+        # with wait, blocks until the holder releases the lock, or for at
+        # most timeout seconds
         if self.args.lockfile is None:
             return
 
@@ -266,7 +633,17 @@ class BaseContext(object):
             self.runLock = open(self.args.lockfile, "a+")
 
         try:
-            fcntl.lockf(self.runLock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if wait:
+                waitForLock(self.runLock.fileno(), timeout)
+            else:
+                fcntl.lockf(self.runLock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # unlock() removes the file before unlocking it, a lock on a
+            # removed file is no lock
+            try:
+                if os.fstat(self.runLock.fileno()).st_ino != os.stat(self.args.lockfile).st_ino:
+                    raise IOError(errno.ENOENT, "lock file was replaced")
+            except OSError, e:
+                raise IOError(e.errno, e.strerror)
             self.runLock.seek(0)
             self.runLock.truncate()
             self.runLock.write("%s" % os.getpid())
@@ -274,6 +651,7 @@ class BaseContext(object):
         except IOError, e:
             runningPid = self.runLock.readline()
             self.runLock.close()
+            self.runLock = None
             raise LockError, _("Unable to obtain exclusive lock. Locked by PID: %s." % runningPid)
 
 
@@ -324,21 +702,37 @@ class BaseContext(object):
 
 
     @traceLog()
-    def doLockLoop(self):
-        # loop until we acquire runtime lock
+    def doLockLoop(self, timeout=None):
+        # wait until we acquire runtime lock, blocked in fcntl so we get it
+        # as soon as it is released. gives up with LockError after timeout
+        # seconds (default --lock-timeout).
         # print helpful error message with PID of lock holder if we dont get it
+        if timeout is None:
+            timeout = self.args.lock_timeout
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
         lockerr = ""
         while True:
             try:
                 self.lock()
+                return
             except LockError, e:
                 if str(e) != lockerr:
                     lockerr = str(e)
                     moduleLog.critical(lockerr)
-                moduleLog.critical(_("Another app is currently holding the lock; waiting for it to exit..."))
-                time.sleep(2)
-            else:
-                break
+                    moduleLog.critical(_("Another app is currently holding the lock; waiting for it to exit..."))
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise LockError, lockerr
+            try:
+                self.lock(wait=True, timeout=remaining)
+                return
+            except LockError:
+                # timed out, or the holder removed the file as we got it
+                pass
 
 
     @traceLog()
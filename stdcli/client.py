@@ -0,0 +1,96 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Client for the command server (see stdcli.server). Imports nothing else
+from stdcli, and the stdcli package itself looks up nothing on import, so
+forwarding a command costs little more than starting python.
+
+Protocol: the client sends one JSON line {"argv": [...], "env": {...},
+"cwd": "..."}. The server answers with frames of a 1 byte channel, a 4
+byte length and the data: channel "1" is stdout, "2" is stderr and the
+last frame, "x", holds the exit code.
+"""
+
+import os
+import sys
+import json
+import socket
+import struct
+
+FRAME_HEADER = "!cI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+STDOUT = "1"
+STDERR = "2"
+EXIT = "x"
+
+def writeFrame(sock, channel, data):
+    sock.sendall(struct.pack(FRAME_HEADER, channel, len(data)) + data)
+
+def _recvAll(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError("command server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+def readFrame(sock):
+    channel, size = struct.unpack(FRAME_HEADER, _recvAll(sock, FRAME_HEADER_SIZE))
+    return channel, _recvAll(sock, size)
+
+def runCommand(socket_path, argv, env=None, cwd=None, stdout=None, stderr=None):
+    """run argv on the server listening on socket_path, returns the exit code"""
+    if env is None:
+        env = dict(os.environ)
+    if cwd is None:
+        cwd = os.getcwd()
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"argv": list(argv), "env": env, "cwd": cwd}) + "\n")
+        outputs = {STDOUT: stdout, STDERR: stderr}
+        while True:
+            channel, data = readFrame(sock)
+            if channel == EXIT:
+                return int(data)
+            outputs[channel].write(data)
+            outputs[channel].flush()
+    finally:
+        sock.close()
+
+def main(args=None):
+    """stdcli-client SOCKET [ARGS...]"""
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        print >> sys.stderr, "usage: stdcli-client SOCKET [ARGS...]"
+        return 2
+    try:
+        return runCommand(args[0], args[1:])
+    except (socket.error, EOFError), e:
+        print >> sys.stderr, "stdcli-client: %s: %s" % (args[0], e)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
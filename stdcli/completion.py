@@ -0,0 +1,208 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Shell completion from a precomputed index of the command line parser.
+
+BaseContext saves the options, nargs, choices and subcommands of the whole
+parser tree whenever the set of plugins changes. The stdcli-complete entry
+point answers completion queries from that file alone, without importing
+the application or its plugins. For bash:
+
+    complete -C "stdcli-complete MODULE" PROGRAM
+
+The index is as current as the last full (non --lazy-plugins) run.
+"""
+
+import os
+import sys
+import json
+
+import entrypoints
+
+# bump when the layout of the index changes
+INDEX_FORMAT = 1
+
+def indexFile(module_name):
+    # not keyed on sys.path like the entry point cache, the completion
+    # script does not run with the sys.path of the program
+    return os.path.join(entrypoints.cacheDir(), "completion-%s.json" % module_name)
+
+def _choices(action):
+    if action.choices is None:
+        return None
+    return [ str(c) for c in action.choices ]
+
+def buildIndex(parser):
+    """
+    {"options": {option_string: [nargs, choices]}, "positionals": [[nargs,
+    choices]], "commands": {name: index of subcommand parser}}
+    Lazily added subcommand parsers are built.
+    """
+    import argparse
+    result = {"options": {}, "positionals": [], "commands": {}}
+    for action in parser._actions:
+        if action.help == argparse.SUPPRESS:
+            continue
+        if isinstance(action, argparse._SubParsersAction):
+            for name in action._name_parser_map.keys():
+                result["commands"][name] = buildIndex(action._get_parser(name))
+        elif action.option_strings:
+            for option_string in action.option_strings:
+                result["options"][option_string] = [action.nargs, _choices(action)]
+        else:
+            result["positionals"].append([action.nargs, _choices(action)])
+    return result
+
+def updateIndex(parser, filename, key):
+    """rewrite the index if the one in filename was not built for key"""
+    # the key is on a line of its own, so checking it is cheap
+    try:
+        fd = open(filename)
+        try:
+            if fd.readline().strip() == key:
+                return
+        finally:
+            fd.close()
+    except (IOError, OSError):
+        pass
+    index = {"format": INDEX_FORMAT, "parser": buildIndex(parser)}
+    entrypoints.writeCacheFile(filename, index, header=key)
+
+def loadIndex(filename):
+    try:
+        fd = open(filename)
+        try:
+            fd.readline()
+            index = json.load(fd)
+        finally:
+            fd.close()
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get("format") != INDEX_FORMAT:
+        return None
+    return index["parser"]
+
+def _argCount(nargs):
+    # how many of the following words an option takes. optional and
+    # variable counts are taken to be their minimum.
+    if nargs is None:
+        return 1
+    if nargs in ("+", "A..."):
+        return 1
+    if isinstance(nargs, int):
+        return nargs
+    return 0
+
+def _findOption(nodes, word):
+    # innermost parser first, then unique abbreviations as argparse allows
+    for node in reversed(nodes):
+        if word in node["options"]:
+            return node["options"][word]
+    matches = {}
+    for node in nodes:
+        for option_string, option in node["options"].items():
+            if option_string.startswith(word):
+                matches[option_string] = option
+    if len(matches) == 1:
+        return matches.values()[0]
+    return None
+
+def complete(index, words, current):
+    """
+    candidates for the word being typed, current, given the words before it
+    (not including the program name)
+    """
+    # the options of every parser on the way down are accepted, the global
+    # options are parsed from anywhere on the command line
+    nodes = [index]
+    positionals = 0
+    pending = None
+    only_positionals = False
+    for word in words:
+        if pending is not None and pending[0] > 0:
+            pending[0] -= 1
+            continue
+        pending = None
+        if word == "--" and not only_positionals:
+            only_positionals = True
+        elif word.startswith("-") and not only_positionals:
+            option = _findOption(nodes, word.split("=", 1)[0])
+            if option is not None and "=" not in word:
+                pending = [_argCount(option[0]), option[1]]
+        elif positionals == 0 and word in nodes[-1]["commands"]:
+            nodes.append(nodes[-1]["commands"][word])
+        else:
+            positionals += 1
+
+    # an argument of the previous option
+    if pending is not None and pending[0] > 0:
+        return sorted([ c for c in pending[1] or [] if c.startswith(current) ])
+
+    if current.startswith("-") and not only_positionals:
+        if "=" in current:
+            option_string, value = current.split("=", 1)
+            option = _findOption(nodes, option_string)
+            if option is None:
+                return []
+            return sorted([ "%s=%s" % (option_string, c) for c in option[1] or [] if c.startswith(value) ])
+        candidates = []
+        for node in nodes:
+            candidates.extend([ o for o in node["options"] if o.startswith(current) ])
+        return sorted(set(candidates))
+
+    node = nodes[-1]
+    if positionals == 0 and node["commands"]:
+        return sorted([ c for c in node["commands"] if c.startswith(current) ])
+    if positionals < len(node["positionals"]):
+        choices = node["positionals"][positionals][1] or []
+        return sorted([ c for c in choices if c.startswith(current) ])
+    return []
+
+def main(args=None):
+    """
+    bash "complete -C" protocol: called as stdcli-complete MODULE PROGRAM
+    CURRENT PREVIOUS with the command line in $COMP_LINE and the cursor
+    position in $COMP_POINT. Prints one candidate per line.
+    """
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) < 2:
+        print >> sys.stderr, "usage: stdcli-complete MODULE PROGRAM [CURRENT [PREVIOUS]]"
+        return 2
+    index = loadIndex(indexFile(args[0]))
+    if index is None:
+        return 1
+
+    line = os.environ.get("COMP_LINE", " ".join(args[1:3]))
+    try:
+        line = line[:int(os.environ["COMP_POINT"])]
+    except (KeyError, ValueError):
+        pass
+    words = line.split()
+    current = ""
+    if words and not line[-1:].isspace():
+        current = words.pop()
+    for candidate in complete(index, words[1:], current):
+        # bash breaks words at "=", it is only completing the value
+        if current.startswith("-") and "=" in current:
+            candidate = candidate.split("=", 1)[1]
+        print candidate
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
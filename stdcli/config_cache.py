@@ -0,0 +1,136 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Cache of the merged config files.
+
+Reading a stack of large ini files with ConfigParser on every run is
+slow. readConfig() saves the sections and options the files add up to
+next to the entry point cache, keyed on the path, size and mtime of every
+file and a hash of the in-memory ones (the packaged default config), and
+loads that instead of the files while none of them has changed. The
+snapshot is marshalled, loading it is much cheaper than JSON.
+
+Set STDCLI_CONFIG_CACHE=0 to always read the files.
+"""
+
+import os
+import json
+import marshal
+import ConfigParser
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+import entrypoints
+
+# bump when the layout of the cache file changes
+CACHE_FORMAT = 1
+
+def cacheEnabled():
+    return os.environ.get("STDCLI_CONFIG_CACHE", "1") not in ("", "0")
+
+def configKey(config_files):
+    """
+    what the config read from config_files depends on, or None if that is
+    not known (a file object that cannot be hashed)
+    """
+    key = [CACHE_FORMAT]
+    for fn in config_files:
+        if hasattr(fn, "readline"):
+            if not hasattr(fn, "getvalue"):
+                return None
+            key.append(["data", md5(fn.getvalue()).hexdigest()])
+            continue
+        path = os.path.abspath(fn)
+        try:
+            st = os.stat(path)
+            key.append(["file", path, st.st_size, st.st_mtime, st.st_ctime, st.st_ino])
+        except OSError:
+            # ConfigParser.read() skips missing files
+            key.append(["file", path, None])
+    return key
+
+def cacheFile(module_name, config_files):
+    # one file per list of configs, so a changed config replaces its
+    # snapshot instead of adding one
+    names = [ os.path.abspath(fn) for fn in config_files if not hasattr(fn, "readline") ]
+    return entrypoints.cacheFile("config-%s-%s" % (module_name, md5(repr(names)).hexdigest()[:8]), suffix=".marshal")
+
+def snapshot(conf):
+    """sections and options of conf, in order, as lists"""
+    return {
+        "format": CACHE_FORMAT,
+        "defaults": conf.defaults().items(),
+        "sections": [ [section, conf._sections[section].items()] for section in conf.sections() ],
+        }
+
+def restore(data):
+    """ConfigParser holding what snapshot() returned"""
+    conf = ConfigParser.ConfigParser()
+    conf._defaults.update(data["defaults"])
+    for section, items in data["sections"]:
+        # raw, like readfp() leaves it, including __name__
+        conf._sections[section] = conf._dict(items)
+    return conf
+
+def loadSnapshot(filename, key):
+    """the ConfigParser saved in filename for key, or None"""
+    try:
+        fd = open(filename)
+        try:
+            # the key is on a line of its own, a stale file is not parsed
+            if fd.readline().strip() != key:
+                return None
+            data = marshal.loads(fd.read())
+        finally:
+            fd.close()
+        if data.get("format") != CACHE_FORMAT:
+            return None
+        return restore(data)
+    except (IOError, OSError, ValueError, EOFError, KeyError, TypeError, AttributeError):
+        return None
+
+def readConfig(config_files, module_name):
+    """a ConfigParser with config_files (names or file objects) read in order"""
+    key = None
+    if cacheEnabled():
+        key = configKey(config_files)
+    if key is not None:
+        # taken before reading, so a file changed meanwhile makes it stale
+        key = json.dumps(key)
+        filename = cacheFile(module_name, config_files)
+        conf = loadSnapshot(filename, key)
+        if conf is not None:
+            # leave file objects at the end, as if they had been read
+            for fn in config_files:
+                if hasattr(fn, "readline"):
+                    fn.seek(0, os.SEEK_END)
+            return conf
+
+    conf = ConfigParser.ConfigParser()
+    for fn in config_files:
+        if hasattr(fn, "readline"):
+            conf.readfp(fn)
+        else:
+            conf.read(fn)
+
+    if key is not None:
+        entrypoints.writeCacheFile(filename, snapshot(conf), header=key, dumps=marshal.dumps)
+    return conf
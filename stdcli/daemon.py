@@ -4,6 +4,7 @@
 import sys, os, time
 from signal import SIGTERM
 from stdcli.trace_decorator import traceLog, getLog
+from stdcli.log_handlers import flushLogs
 
 class Daemon:
     """
@@ -25,6 +26,8 @@ class Daemon:
         Programming in the UNIX Environment" for details (ISBN 0201563177)
         http://www.erlenstar.demon.co.uk/unix/faq_2.html#SEC16
         """
+        # the parents leave with os._exit(), write out queued log records
+        flushLogs()
         try:
             pid = os.fork()
             if pid > 0:
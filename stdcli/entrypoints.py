@@ -0,0 +1,202 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+On-disk cache of installed entry points and distribution versions.
+
+Importing pkg_resources scans and parses the metadata of everything on
+sys.path. The index built from it is saved as JSON, keyed on a fingerprint
+of the mtimes of the sys.path entries and the metadata directories in them,
+so a startup that hits the cache never imports pkg_resources.
+
+Set STDCLI_ENTRYPOINT_CACHE=0 to always build the index from pkg_resources,
+and STDCLI_CACHE_DIR to move the cache from ~/.cache/stdcli.
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+# bump when the layout of the cache file changes
+CACHE_FORMAT = 1
+
+METADATA_SUFFIXES = (".egg-info", ".dist-info", ".egg", ".egg-link")
+
+class DistributionNotFound(Exception): pass
+
+class CachedEntryPoint(object):
+    """
+    The parts of pkg_resources.EntryPoint that stdcli uses. load() imports
+    the module directly, it does not check the distribution requirements.
+    """
+    def __init__(self, name, module_name, attrs, dist):
+        self.name = name
+        self.module_name = module_name
+        self.attrs = tuple(attrs)
+        self.dist = dist
+
+    def load(self):
+        entry = __import__(self.module_name, {}, {}, ['__name__'], 0)
+        for attr in self.attrs:
+            try:
+                entry = getattr(entry, attr)
+            except AttributeError:
+                raise ImportError("%r has no %r attribute" % (entry, attr))
+        return entry
+
+    def __repr__(self):
+        return "CachedEntryPoint(%s = %s:%s)" % (self.name, self.module_name, ".".join(self.attrs))
+
+def cacheEnabled():
+    return os.environ.get("STDCLI_ENTRYPOINT_CACHE", "1") not in ("", "0")
+
+def cacheDir():
+    return os.environ.get("STDCLI_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "stdcli")
+
+def cacheFile(prefix="entrypoints", suffix=".json"):
+    # one cache per interpreter and sys.path, so different tools dont thrash it
+    key = md5(repr((sys.executable, sys.path))).hexdigest()[:16]
+    return os.path.join(cacheDir(), "%s-%s%s" % (prefix, key, suffix))
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def fingerprint():
+    """mtimes of sys.path entries and the distribution metadata in them"""
+    result = []
+    for entry in sys.path:
+        entry = entry or os.curdir
+        result.append([entry, _mtime(entry)])
+        try:
+            names = os.listdir(entry)
+        except OSError:
+            continue
+        names.sort()
+        for name in names:
+            if not name.lower().endswith(METADATA_SUFFIXES):
+                continue
+            path = os.path.join(entry, name)
+            result.append([path, _mtime(path)])
+            for meta in ("entry_points.txt", "PKG-INFO", "METADATA", os.path.join("EGG-INFO", "entry_points.txt")):
+                mtime = _mtime(os.path.join(path, meta))
+                if mtime is not None:
+                    result.append([os.path.join(path, meta), mtime])
+    return result
+
+def buildIndex():
+    """ask pkg_resources for every distribution version and entry point"""
+    import pkg_resources
+    versions = {}
+    groups = {}
+    for dist in pkg_resources.working_set:
+        versions.setdefault(dist.key, dist.version)
+        for group, entries in dist.get_entry_map().items():
+            for name, ep in sorted(entries.items()):
+                groups.setdefault(group, []).append([name, ep.module_name, list(ep.attrs), dist.project_name])
+    return {"format": CACHE_FORMAT, "versions": versions, "entry_points": groups}
+
+def loadIndex(filename=None):
+    """the cached index, or None if there is none or it is stale"""
+    filename = filename or cacheFile()
+    try:
+        fd = open(filename)
+        try:
+            index = json.load(fd)
+        finally:
+            fd.close()
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get("format") != CACHE_FORMAT or index.get("fingerprint") != fingerprint():
+        return None
+    return index
+
+def saveIndex(index, filename=None):
+    writeCacheFile(filename or cacheFile(), index)
+
+def writeCacheFile(filename, data, header=None, dumps=None):
+    """
+    atomically replace filename with data as JSON (or serialized by dumps),
+    after a line with header if given. errors are ignored.
+    """
+    if dumps is None:
+        dumps = lambda data: json.dumps(data, separators=(",", ":"))
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".entrypoints")
+        try:
+            if header is not None:
+                os.write(fd, header + "\n")
+            os.write(fd, dumps(data))
+        finally:
+            os.close(fd)
+        os.rename(tmpname, filename)
+    except (IOError, OSError):
+        # cache is an optimization only, eg. home dir may be read-only
+        pass
+
+_index = None
+
+def getIndex(rebuild=False):
+    global _index
+    if _index is not None and not rebuild:
+        return _index
+    index = None
+    if cacheEnabled() and not rebuild:
+        index = loadIndex()
+    if index is None:
+        # fingerprint before building so a concurrent install makes it stale
+        stamp = fingerprint()
+        index = buildIndex()
+        index["fingerprint"] = stamp
+        if cacheEnabled():
+            saveIndex(index)
+    _index = index
+    return _index
+
+def clearCache():
+    global _index
+    _index = None
+    try:
+        os.unlink(cacheFile())
+    except OSError:
+        pass
+
+def getVersion(project_name):
+    try:
+        return str(getIndex()["versions"][project_name.lower()])
+    except KeyError:
+        # maybe installed since the index was built
+        try:
+            return str(getIndex(rebuild=True)["versions"][project_name.lower()])
+        except KeyError:
+            raise DistributionNotFound(project_name)
+
+def iterEntryPoints(group, name=None):
+    """like pkg_resources.iter_entry_points(), from the cached index"""
+    for ep_name, module_name, attrs, dist in getIndex()["entry_points"].get(group, []):
+        if name is None or name == ep_name:
+            yield CachedEntryPoint(str(ep_name), str(module_name), [ str(a) for a in attrs ], dist)
@@ -0,0 +1,532 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+logging handlers that keep file I/O off the calling thread.
+"""
+
+import os
+import re
+import sys
+import time
+import gzip
+import json
+import Queue
+import shutil
+import logging
+import weakref
+import threading
+import traceback
+
+from trace_decorator import TraceMessage, LimitedRepr
+
+# queued in place of a record to stop the writer thread
+_STOP = object()
+
+# every handler that holds records back, for flushLogs()
+_instances = weakref.WeakSet()
+
+# per thread: how deep in a queue operation it is, and the exit a signal
+# handler asked for meanwhile
+_state = threading.local()
+
+def exitWhenSafe(code=None):
+    """
+    sys.exit(code) for a signal handler. An exception raised inside a
+    Queue.Queue operation can leave it with a task counted but nobody
+    woken, so if the signal interrupted one in this thread the exit is
+    raised once the operation is done.
+
+    the exit stays pending until exitDone(): raised in a finalizer (a
+    weakref callback, __del__) the interpreter prints and drops it, so
+    every record this thread queues raises it again.
+    """
+    _state.exit = (code,)
+    _exitIfPending()
+
+def exitDone():
+    """the exit from exitWhenSafe() got through, stop raising it again"""
+    _state.exit = None
+
+def _exitIfPending():
+    exit = getattr(_state, "exit", None)
+    if exit is not None and not getattr(_state, "depth", 0):
+        sys.exit(exit[0])
+
+def _enterQueue():
+    _state.depth = getattr(_state, "depth", 0) + 1
+
+def _leaveQueue():
+    _state.depth -= 1
+    _exitIfPending()
+
+def flushLogs():
+    """
+    wait until every record queued by a BackgroundQueueHandler or buffered
+    by a LogFileHandler is written. call before leaving with os._exit() or
+    fork(), which skip the flush logging.shutdown() does at exit.
+    """
+    for hdlr in list(_instances):
+        hdlr.flush()
+
+class BackgroundQueueHandler(logging.Handler):
+    """
+    Base class for handlers whose emit() only puts the record on a bounded
+    queue. A background thread drains the queue in batches and hands them to
+    write(). When the queue is full, records are dropped (and counted in
+    self.dropped) rather than blocking the caller, unless block is set.
+
+    Subclasses implement write(items) and may override prepare(record),
+    which runs on the calling thread and turns a record into a queue item.
+    """
+    def __init__(self, maxsize=10000, block=False):
+        logging.Handler.__init__(self)
+        self.maxsize = maxsize
+        self.block = block
+        self.dropped = 0
+        self._startWriter()
+        _instances.add(self)
+
+    def _startWriter(self):
+        # also called after fork(), the writer thread does not survive it
+        self._pid = os.getpid()
+        self.queue = Queue.Queue(self.maxsize)
+        self._writer = threading.Thread(target=self._drain, name="%s writer" % self.__class__.__name__)
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+    def prepare(self, record):
+        return record
+
+    def write(self, items):
+        raise NotImplementedError
+
+    def emit(self, record):
+        self._enqueue(record, self.prepare)
+
+    def _enqueue(self, record, prepare):
+        if self._pid != os.getpid():
+            self._startWriter()
+        _enterQueue()
+        try:
+            try:
+                self.queue.put(prepare(record), self.block)
+            except Queue.Full:
+                self.dropped += 1
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.handleError(record)
+        finally:
+            _leaveQueue()
+
+    def _drain(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.maxsize:
+                    batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            stop = _STOP in batch
+            items = [ i for i in batch if i is not _STOP ]
+            try:
+                if items:
+                    self.write(items)
+            except:
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+            for i in batch:
+                self.queue.task_done()
+            if stop:
+                break
+
+    def flush(self):
+        """wait until everything queued so far is written"""
+        if self._pid == os.getpid() and self._writer.isAlive():
+            _enterQueue()
+            try:
+                self.queue.join()
+            finally:
+                _leaveQueue()
+
+    def close(self):
+        if self._pid == os.getpid() and self._writer.isAlive():
+            self.queue.put(_STOP)
+            self._writer.join()
+        logging.Handler.close(self)
+
+
+class JsonTraceHandler(BackgroundQueueHandler):
+    """
+    Writes traceLog() ENTER/LEAVE records as compact JSON lines with the
+    function, module, line, thread, timestamp, duration, exception class and
+    truncated argument reprs. Other records are ignored. The argument reprs
+    are taken on the calling thread, json encoding and disk writes happen on
+    the writer thread.
+    """
+    def __init__(self, filename, maxsize=10000, maxlevel=3, maxlength=200):
+        self.filename = filename
+        self.stream = open(filename, "a")
+        self.repr = LimitedRepr(maxlevel, maxlength).repr
+        BackgroundQueueHandler.__init__(self, maxsize)
+
+    def prepare(self, record):
+        msg = record.msg
+        entry = {
+            "event": msg.event,
+            "function": msg.func_name,
+            "module": msg.module,
+            "line": msg.lineno,
+            "thread": record.threadName,
+            "timestamp": record.created,
+            }
+        if msg.event == "ENTER":
+            entry["args"] = [ self.repr(i) for i in msg.args ]
+            entry["kwargs"] = dict([ (k, self.repr(v)) for k, v in msg.kw.items() ])
+        else:
+            entry["duration"] = msg.duration
+            entry["exception"] = msg.exception and msg.exception.__name__
+            entry["result"] = self.repr(msg.result)
+        return entry
+
+    def emit(self, record):
+        if isinstance(record.msg, TraceMessage):
+            BackgroundQueueHandler.emit(self, record)
+
+    def write(self, items):
+        self.stream.write("".join([ json.dumps(i, separators=(",", ":")) + "\n" for i in items ]))
+        self.stream.flush()
+
+    def close(self):
+        BackgroundQueueHandler.close(self)
+        self.stream.close()
+
+
+class AsyncHandler(BackgroundQueueHandler):
+    """
+    Passes records on to other handlers from the writer thread, so logging
+    calls do no I/O. The message is rendered on the calling thread, the
+    traceback by the formatters of the handlers on the writer thread.
+    route() gives a handler for another logger that sends records to
+    a different set of handlers through the same queue and thread.
+
+    Waits for room in the queue when it is full, records are not dropped.
+    """
+    def __init__(self, handlers, maxsize=10000):
+        self.handlers = list(handlers)
+        BackgroundQueueHandler.__init__(self, maxsize, block=True)
+        self.setLevel(_lowestLevel(self.handlers))
+
+    def handle(self, record):
+        # emit() only queues, it needs no handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def prepare(self, record, handlers=None):
+        # a copy, the handlers of parent loggers get the record too.
+        # LogRecord.__init__ is too slow to run again here.
+        copy = logging.LogRecord.__new__(record.__class__)
+        copy.__dict__.update(record.__dict__)
+        copy.msg = record.getMessage()
+        copy.args = None
+        if handlers is None:
+            handlers = self.handlers
+        return copy, handlers
+
+    def route(self, handlers):
+        return _AsyncRoute(self, handlers)
+
+    def write(self, items):
+        # the records of a batch for each handler in one go
+        batches = {}
+        order = []
+        for record, handlers in items:
+            for hdlr in handlers:
+                if record.levelno >= hdlr.level:
+                    if hdlr not in batches:
+                        batches[hdlr] = []
+                        order.append(hdlr)
+                    batches[hdlr].append(record)
+        for hdlr in order:
+            if type(hdlr) in (logging.StreamHandler, logging.FileHandler) and hdlr.stream is not None:
+                _writeStream(hdlr, batches[hdlr])
+            else:
+                for record in batches[hdlr]:
+                    hdlr.handle(record)
+
+    def flush(self):
+        BackgroundQueueHandler.flush(self)
+        for hdlr in self.handlers:
+            hdlr.flush()
+
+
+class _AsyncRoute(logging.Handler):
+    def __init__(self, pipeline, handlers):
+        logging.Handler.__init__(self)
+        self.pipeline = pipeline
+        self.handlers = list(handlers)
+        self.setLevel(_lowestLevel(self.handlers))
+
+    handle = AsyncHandler.handle.im_func
+
+    def emit(self, record):
+        self.pipeline._enqueue(record, lambda r: self.pipeline.prepare(r, self.handlers))
+
+    def flush(self):
+        self.pipeline.flush()
+
+
+def _writeStream(hdlr, records):
+    # what StreamHandler.emit() does, with one write and flush for all
+    lines = []
+    for record in records:
+        if not hdlr.filter(record):
+            continue
+        try:
+            msg = hdlr.format(record)
+            if isinstance(msg, unicode):
+                msg = msg.encode(getattr(hdlr.stream, "encoding", None) or "UTF-8", "replace")
+            lines.append(msg + "\n")
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            hdlr.handleError(record)
+    hdlr.acquire()
+    try:
+        hdlr.stream.write("".join(lines))
+        hdlr.flush()
+    finally:
+        hdlr.release()
+
+def _lowestLevel(handlers):
+    if not handlers:
+        return logging.NOTSET
+    return min([ h.level for h in handlers ])
+
+def makeAsync(loggers):
+    """
+    move the handlers of loggers, the first of which is the root logger,
+    behind one AsyncHandler. handlers that already write from a thread of
+    their own are left alone. returns the AsyncHandler.
+    """
+    def moved(logger):
+        handlers = [ h for h in logger.handlers if not isinstance(h, BackgroundQueueHandler) ]
+        for hdlr in handlers:
+            logger.removeHandler(hdlr)
+        return handlers
+
+    pipeline = AsyncHandler(moved(loggers[0]))
+    loggers[0].addHandler(pipeline)
+    for logger in loggers[1:]:
+        handlers = moved(logger)
+        if handlers:
+            logger.addHandler(pipeline.route(handlers))
+    return pipeline
+
+
+class LogFileHandler(logging.FileHandler):
+    """
+    FileHandler for long running programs. With the defaults it behaves
+    like FileHandler.
+
+    buffer_size: records are written once this many bytes are buffered, or
+        flush_interval seconds after the oldest buffered one, by a
+        background thread if nothing else is logged.
+    max_bytes, rotate_interval: the file is moved aside once it would grow
+        beyond max_bytes, or every rotate_interval seconds. rotated files
+        are named FILENAME.YYYYmmdd-HHMMSS-uuuuuu[.N] and the newest backups
+        of them are kept, other files next to FILENAME are left alone.
+    compress: rotated files are gzipped by a background thread.
+
+    errors counts the writes, rotations and compressions that failed.
+    """
+    def __init__(self, filename, buffer_size=0, flush_interval=1.0, max_bytes=0, rotate_interval=0, backups=5, compress=False):
+        logging.FileHandler.__init__(self, filename)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+        self.compress = compress
+        self.buffer = []
+        self.buffered = 0
+        self.first_buffered = None
+        self.next_rotation = None
+        if rotate_interval:
+            self.next_rotation = time.time() + rotate_interval
+        self._pid = None
+        self._closed = threading.Event()
+        self._compressor = None
+        self._compress_queue = None
+        # rotated files not compressed yet, _removeOld() leaves them
+        self._pending = set()
+        self.errors = 0
+        self._rotated_re = re.compile(r"%s\.(\d{8}-\d{6}-\d{6})(?:\.(\d+))?(?:\.gz)?$" % re.escape(os.path.basename(self.baseFilename)))
+        _instances.add(self)
+
+    def _startThreads(self):
+        # also after fork(), threads do not survive it
+        self._pid = os.getpid()
+        if self.buffer_size:
+            flusher = threading.Thread(target=self._flushPeriodically, name="LogFileHandler flusher")
+            flusher.setDaemon(True)
+            flusher.start()
+        if self.compress:
+            self._compress_queue = Queue.Queue()
+            self._compressor = threading.Thread(target=self._compressRotated, name="LogFileHandler compressor")
+            self._compressor.setDaemon(True)
+            self._compressor.start()
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            if isinstance(msg, unicode):
+                msg = msg.encode("UTF-8")
+            msg += "\n"
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+            return
+        if self._pid != os.getpid():
+            self._startThreads()
+        if not self.buffer:
+            self.first_buffered = time.time()
+        self.buffer.append(msg)
+        self.buffered += len(msg)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if not self.buffer:
+                if self.stream:
+                    self.stream.flush()
+                return
+            data = "".join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                if self._shouldRotate(len(data)):
+                    self._rotate()
+                self.stream.write(data)
+                self.stream.flush()
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except:
+                self.errors += 1
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+        finally:
+            self.release()
+
+    def _flushPeriodically(self):
+        while not self._closed.isSet():
+            self._closed.wait(self.flush_interval)
+            if self.buffer and time.time() - self.first_buffered >= self.flush_interval:
+                self.flush()
+
+    def _shouldRotate(self, size):
+        if self.max_bytes:
+            self.stream.seek(0, os.SEEK_END)
+            position = self.stream.tell()
+            if position and position + size > self.max_bytes:
+                return True
+        if self.next_rotation is not None and time.time() >= self.next_rotation:
+            while self.next_rotation <= time.time():
+                self.next_rotation += self.rotate_interval
+            return True
+        return False
+
+    def _rotate(self):
+        self.stream.close()
+        self.stream = None
+        # fixed width, so the names sort oldest first
+        now = time.time()
+        stamp = "%s-%06d" % (time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), (now % 1) * 1000000)
+        rotated = "%s.%s" % (self.baseFilename, stamp)
+        i = 0
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            i += 1
+            rotated = "%s.%s.%d" % (self.baseFilename, stamp, i)
+        os.rename(self.baseFilename, rotated)
+        self.stream = self._open()
+        if self.compress:
+            self._pending.add(rotated)
+            self._compress_queue.put(rotated)
+        else:
+            self._removeOld()
+
+    def _compressRotated(self):
+        while True:
+            rotated = self._compress_queue.get()
+            try:
+                if rotated is _STOP:
+                    return
+                src = open(rotated, "rb")
+                try:
+                    dst = gzip.open(rotated + ".gz.tmp", "wb")
+                    try:
+                        shutil.copyfileobj(src, dst)
+                    finally:
+                        dst.close()
+                finally:
+                    src.close()
+                os.rename(rotated + ".gz.tmp", rotated + ".gz")
+                os.unlink(rotated)
+                self._pending.discard(rotated)
+                self._removeOld()
+            except (IOError, OSError):
+                self._pending.discard(rotated)
+                self.errors += 1
+                if logging.raiseExceptions:
+                    traceback.print_exc()
+            finally:
+                self._compress_queue.task_done()
+
+    def _removeOld(self):
+        directory = os.path.dirname(self.baseFilename)
+        rotated = []
+        for n in os.listdir(directory):
+            match = self._rotated_re.match(n)
+            if match:
+                rotated.append(((match.group(1), int(match.group(2) or 0)), n))
+        rotated.sort()
+        # files still queued for compression count, but are removed later
+        for key, n in rotated[:max(len(rotated) - self.backups, 0)]:
+            path = os.path.join(directory, n)
+            if path in self._pending:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def close(self):
+        self.flush()
+        self._closed.set()
+        if self._pid == os.getpid() and self._compressor is not None:
+            # a rotated file is left behind uncompressed, not half written
+            self._compress_queue.put(_STOP)
+            self._compressor.join()
+        logging.FileHandler.close(self)
@@ -1,7 +1,13 @@
 # vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
 
+import sys
+import time
+import types
+import Queue
 import fnmatch
-import pkg_resources
+import threading
+
+import entrypoints
 
 from trace_decorator import traceLog, getLog
 moduleLog = getLog()
@@ -9,11 +15,22 @@ moduleVerboseLog = getLog(prefix="verbose.")
 moduleDebugLog = getLog(prefix="debug.")
 
 class PluginExit(Exception): pass
+class PluginDependencyError(Exception): pass
 
 class Plugin(object): 
+    # names (in the same entry point group) of plugins that have to be
+    # instantiated before this one. loadPlugins(only=...) loads them too,
+    # missing or disabled ones are ignored.
+    depends = ()
+
     def finishedCliParsing(self, *args, **kargs):
         pass
 
+    # add subcommand "name". setup(parser) adds its arguments, it is only
+    # called if the subcommand is used. kargs are passed to add_parser().
+    def addSubcommand(self, ctx, name, setup, **kargs):
+        ctx.subparsers.add_lazy_parser(name, setup, **kargs)
+
 
 class PluginContainer(object):
     def __init__(self, disable, skip_import_errors=False):
@@ -22,8 +39,45 @@ class PluginContainer(object):
         self.plugins = {}
 
     @traceLog()
-    def loadPlugins(self, plugin_type):
-        for entrypoint in pkg_resources.iter_entry_points(plugin_type):
+    def commandPlugins(self, plugin_type, command_type, command_name):
+        """
+        Find the plugins that provide command_name, using the static
+        command_type entry point group (command name = plugin class) so no
+        plugin module is imported. Returns a list of plugin_type entry point
+        names, or None if the command is not declared there, in which case
+        every plugin has to be loaded.
+        """
+        if command_name is None:
+            return None
+        targets = [ (ep.module_name, ep.attrs) for ep in entrypoints.iterEntryPoints(command_type, command_name) ]
+        if not targets:
+            return None
+        names = [ ep.name for ep in entrypoints.iterEntryPoints(plugin_type) if (ep.module_name, ep.attrs) in targets ]
+        return names or None
+
+    @traceLog()
+    def loadPlugins(self, plugin_type, only=None):
+        """
+        Load the plugin_type plugins, or only the ones named in only and
+        the ones they depend on.
+        """
+        self._loadPlugins(plugin_type, only)
+        if only is None:
+            return
+        tried = set(only)
+        while True:
+            plugins = self.plugins.get(plugin_type, {})
+            wanted = set([ d for plugin in plugins.values() for d in getattr(plugin, "depends", ()) ])
+            wanted = wanted - set(plugins.keys()) - tried
+            if not wanted:
+                return
+            tried.update(wanted)
+            self._loadPlugins(plugin_type, wanted)
+
+    def _loadPlugins(self, plugin_type, only):
+        for entrypoint in entrypoints.iterEntryPoints(plugin_type):
+            if only is not None and entrypoint.name not in only:
+                continue
             skip=0
             for excludepat in self.disable:
                     if fnmatch.fnmatch(entrypoint.name, excludepat):
@@ -36,7 +90,7 @@ class PluginContainer(object):
                     plugin_set = self.plugins.get(plugin_type, {})
                     plugin_set[entrypoint.name] = plugin
                     self.plugins[plugin_type] = plugin_set
-                except (ImportError,pkg_resources.DistributionNotFound), e:
+                except (ImportError,entrypoints.DistributionNotFound), e:
                     moduleLog.info("Module %s had import errors, skipping.")
                     moduleVerboseLog.debug("Exception info: %s" % e)
                     if not self.skip_import_errors:
@@ -51,10 +105,106 @@ class PluginContainer(object):
     @traceLog()
     def instantiatePlugins(self, plugin_type, *args, **kargs):
         instantiated_type = plugin_type + "_instantiated"
-        for name, plugin in self.plugins[plugin_type].items():
-                plugin_set = self.plugins.get(instantiated_type, {})
-                plugin_set[name] = plugin(*args, **kargs)
-                self.plugins[instantiated_type] = plugin_set
+        plugin_set = self.plugins.setdefault(instantiated_type, {})
+        for name in self.dependencyOrder(plugin_type):
+            plugin_set[name] = self._instantiate(name, self.plugins[plugin_type][name], args, kargs)
+
+    @traceLog()
+    def instantiatePluginsParallel(self, plugin_type, workers, ctx):
+        """
+        Like instantiatePlugins(plugin_type, ctx), but runs the constructors
+        of plugins that do not depend on each other on up to workers threads.
+        Each plugin gets a proxy of ctx whose subparsers only record the
+        subcommands it adds. They are added to ctx.subparsers afterwards, in
+        dependency order, so help and parsing do not depend on thread timing.
+        Method calls on ctx.parser (and the argument groups made with it)
+        and writes to ctx and ctx.args hold one lock; options go in in the
+        order the constructors get to them. A plugin that keeps the proxy
+        can use it later like ctx.
+        """
+        instantiated_type = plugin_type + "_instantiated"
+        plugin_set = self.plugins.setdefault(instantiated_type, {})
+        order = self.dependencyOrder(plugin_type)
+        depends = dict([ (name, self._dependencies(plugin_type, name)) for name in order ])
+        recorders = {}
+        lock = threading.RLock()
+        todo = Queue.Queue()
+        done = Queue.Queue()
+
+        def worker():
+            while True:
+                name = todo.get()
+                if name is None:
+                    return
+                try:
+                    recorders[name] = _RecordingSubparsers(ctx.subparsers)
+                    result = self._instantiate(name, self.plugins[plugin_type][name], (_PluginContext(ctx, recorders[name], lock),), {})
+                    done.put((name, result, None))
+                except:
+                    done.put((name, None, sys.exc_info()))
+
+        threads = [ threading.Thread(target=worker, name="plugin init %d" % i) for i in range(max(1, workers)) ]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+
+        error = None
+        started = set()
+        try:
+            while len(plugin_set) < len(order) and error is None:
+                for name in order:
+                    if name not in started and [ d for d in depends[name] if d not in plugin_set ] == []:
+                        started.add(name)
+                        todo.put(name)
+                name, result, exc_info = done.get()
+                if exc_info is not None:
+                    error = exc_info
+                else:
+                    plugin_set[name] = result
+            # let the constructors already running finish
+            for i in range(len(started) - len(plugin_set) - (error is not None)):
+                done.get()
+        finally:
+            for thread in threads:
+                todo.put(None)
+            # nothing is running any more, they only pick up the None
+            for thread in threads:
+                thread.join()
+
+        for name in order:
+            if name in recorders:
+                recorders[name].replay()
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+    def _instantiate(self, name, plugin, args, kargs):
+        start = time.time()
+        result = plugin(*args, **kargs)
+        moduleVerboseLog.info("plugin %s initialized in %.1fms" % (name, (time.time() - start) * 1000))
+        return result
+
+    def _dependencies(self, plugin_type, name):
+        plugins = self.plugins[plugin_type]
+        return [ d for d in getattr(plugins[name], "depends", ()) if d in plugins ]
+
+    @traceLog()
+    def dependencyOrder(self, plugin_type):
+        """plugin names with dependencies first, otherwise sorted by name"""
+        order = []
+        state = {}
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise PluginDependencyError("plugin dependency loop: %s" % " -> ".join(path + [name]))
+            state[name] = "visiting"
+            for dependency in sorted(self._dependencies(plugin_type, name)):
+                visit(dependency, path + [name])
+            state[name] = "done"
+            order.append(name)
+        for name in sorted(self.plugins.get(plugin_type, {}).keys()):
+            visit(name, [])
+        return order
 
     @traceLog()
     def eachInstantiatedPlugin(self, plugin_type):
@@ -62,3 +212,95 @@ class PluginContainer(object):
         for plugin in self.plugins[instantiated_type].values():
             yield plugin
 
+
+class _RecordingSubparsers(object):
+    """
+    Stands in for a _SubParsersAction while a plugin is constructed on a
+    worker thread: parsers are created right away, but only added to the
+    real action by replay().
+    """
+    def __init__(self, subparsers):
+        self.subparsers = subparsers
+        self.added = []
+        self.replayed = False
+
+    def add_parser(self, name, **kargs):
+        if self.replayed:
+            return self.subparsers.add_parser(name, **kargs)
+        kargs, choice_action = self.subparsers._get_parser_kwargs(name, kargs)
+        parser = self.subparsers._parser_class(**kargs)
+        self.added.append((name, parser, choice_action))
+        return parser
+
+    def add_lazy_parser(self, name, setup, **kargs):
+        if self.replayed:
+            return self.subparsers.add_lazy_parser(name, setup, **kargs)
+        kargs, choice_action = self.subparsers._get_parser_kwargs(name, kargs)
+        parser = self.subparsers._LazyParser(self.subparsers._parser_class, kargs, setup)
+        self.added.append((name, parser, choice_action))
+
+    def replay(self):
+        for name, parser, choice_action in self.added:
+            self.subparsers._register_parser(name, parser, choice_action)
+        self.added = []
+        # from now on the plugin is not on a worker thread any more
+        self.replayed = True
+
+    def __getattr__(self, name):
+        return getattr(self.subparsers, name)
+
+
+class _Locked(object):
+    """
+    obj shared by plugins constructed on worker threads: its methods are
+    called and its attributes set with lock held. argument groups returned
+    by the methods are wrapped too.
+    """
+    def __init__(self, obj, lock):
+        self.__dict__["_obj"] = obj
+        self.__dict__["_lock"] = lock
+
+    # isinstance() checks this too
+    __class__ = property(lambda self: self._obj.__class__)
+
+    def __getattr__(self, name):
+        value = getattr(self._obj, name)
+        if not isinstance(value, types.MethodType):
+            return value
+        lock = self._lock
+        def locked(*args, **kargs):
+            lock.acquire()
+            try:
+                result = value(*args, **kargs)
+            finally:
+                lock.release()
+            if hasattr(result, "add_argument"):
+                return _Locked(result, lock)
+            return result
+        return locked
+
+    def __setattr__(self, name, value):
+        self._lock.acquire()
+        try:
+            setattr(self._obj, name, value)
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        return key in self._obj
+
+    def __eq__(self, other):
+        return self._obj == other
+
+    def __ne__(self, other):
+        return self._obj != other
+
+
+class _PluginContext(_Locked):
+    """ctx as seen by a plugin constructed by instantiatePluginsParallel()"""
+    def __init__(self, ctx, subparsers, lock):
+        _Locked.__init__(self, ctx, lock)
+        self.__dict__["subparsers"] = subparsers
+        self.__dict__["parser"] = _Locked(ctx.parser, lock)
+        if hasattr(ctx, "args"):
+            self.__dict__["args"] = _Locked(ctx.args, lock)
@@ -1,5 +1,5 @@
 from stdcli.trace_decorator import traceLog, getLog
-import pkg_resources
+from stdcli import entrypoints
 
 moduleLog = getLog()
 moduleVerboseLog = getLog(prefix="verbose.")
@@ -14,7 +14,10 @@ class DumpConfigPlugin(Plugin):
         moduleDebugLog.debug("initializing plugin: %s" % self.__class__.__name__)
 
         # subparser for dumping config (note this is what plugins should do)
-        dump_p = ctx.subparsers.add_parser("dump-config", help="Dumps the current config for debug purposes")
+        self.addSubcommand(ctx, "dump-config", self.dumpConfigParser, help="Dumps the current config for debug purposes")
+
+    @traceLog()
+    def dumpConfigParser(self, dump_p):
         dump_p.set_defaults(func=self.dumpConfigImpl)
 
     @traceLog()
@@ -23,7 +26,15 @@ class DumpConfigPlugin(Plugin):
         transforms = {
             "config_files": lambda x: ",".join(x),
             "disabled_plugins": lambda x: ",".join(x),
-            "lockfile": lambda x: x or ''
+            "lockfile": lambda x: x or '',
+            "lock_timeout": lambda x: x or '',
+            "trace_sample": lambda x: x or '',
+            "trace_maxlevel": lambda x: x or '',
+            "trace_maxlength": lambda x: x or '',
+            "trace_modules": lambda x: ",".join(x),
+            "trace_profile": lambda x: x or '',
+            "trace_profile_file": lambda x: x or '',
+            "trace_json_file": lambda x: x or '',
             }
         def trans(t, i):
             return transforms.get(t, lambda x: x)(i)
@@ -42,6 +53,7 @@ class DumpConfigPlugin(Plugin):
         dist_items = ["version", "egg_name", "project_name", "py_version", "location", "requires"]
         transforms = { "egg_name": lambda x: x(), "requires": lambda x: x() }
         import stdcli.cli_main
+        import pkg_resources
         dist = pkg_resources.get_distribution(stdcli.cli_main.moduleName)
         print "[egg-info]"
         for i in dist_items:
@@ -50,6 +62,68 @@ class DumpConfigPlugin(Plugin):
         print
 
 
+class EntryPointCachePlugin(Plugin):
+    @traceLog()
+    def __init__(self, ctx):
+        moduleDebugLog.debug("initializing plugin: %s" % self.__class__.__name__)
+
+        self.addSubcommand(ctx, "entrypoint-cache", self.entryPointCacheParser, help="Inspect or rebuild the cached entry point index")
+
+    @traceLog()
+    def entryPointCacheParser(self, cache_p):
+        cache_p.add_argument("--rebuild", action="store_true", default=False, help="Rebuild the index from pkg_resources")
+        cache_p.add_argument("--clear", action="store_true", default=False, help="Remove the cache file")
+        cache_p.set_defaults(func=self.entryPointCacheImpl)
+
+    @traceLog()
+    def entryPointCacheImpl(self, ctx):
+        if ctx.args.clear:
+            entrypoints.clearCache()
+        if ctx.args.rebuild:
+            entrypoints.getIndex(rebuild=True)
+
+        print "[entrypoint-cache]"
+        print "file: %s" % entrypoints.cacheFile()
+        print "enabled: %s" % int(entrypoints.cacheEnabled())
+        print "valid: %s" % int(entrypoints.loadIndex() is not None)
+        if ctx.args.clear and not ctx.args.rebuild:
+            return
+
+        index = entrypoints.getIndex()
+        print "distributions: %s" % len(index["versions"])
+        print
+        import stdcli.cli_main
+        for group in sorted(index["entry_points"].keys()):
+            if not group.startswith("%s_cli_" % stdcli.cli_main.moduleName):
+                continue
+            print "[%s]" % group
+            for ep in entrypoints.iterEntryPoints(group):
+                print "%s: %s:%s" % (ep.name, ep.module_name, ".".join(ep.attrs))
+            print
+
+
+class ServerPlugin(Plugin):
+    @traceLog()
+    def __init__(self, ctx):
+        moduleDebugLog.debug("initializing plugin: %s" % self.__class__.__name__)
+
+        self.addSubcommand(ctx, "server", self.serverParser, help="Keep plugins loaded and run commands sent by stdcli-client over a Unix socket")
+
+    @traceLog()
+    def serverParser(self, server_p):
+        server_p.add_argument("--socket", action="store", dest="server_socket", required=True, metavar="PATH", help="Unix socket to listen on")
+        server_p.add_argument("--foreground", action="store_true", dest="server_foreground", default=False, help="Do not daemonize")
+        server_p.add_argument("--prefork", action="store", dest="server_prefork", type=int, default=0, metavar="N", help="Keep N processes forked ahead of time, each runs one command")
+        server_p.set_defaults(func=self.serverImpl)
+
+    @traceLog()
+    def serverImpl(self, ctx):
+        from stdcli.server import CommandServer
+        if ctx.args.lazy_plugins:
+            moduleLog.warning("the server only has the plugins loaded by --lazy-plugins")
+        CommandServer(ctx, ctx.args.server_socket, prefork=ctx.args.server_prefork, foreground=ctx.args.server_foreground).start()
+
+
 class SamplePlugin(Plugin):
     @traceLog()
     def __init__(self, ctx):
@@ -58,7 +132,11 @@ class SamplePlugin(Plugin):
         # adds a separate parser with subcommands for our plugin. 
         # for this sample, the command is called "samplecmd", and the "--test1" and "--test2"
         # arguments are only ever valid after samplecmd has been specified.
-        sample_p = ctx.subparsers.add_parser("samplecmd", help="Demo subcmd for sample purposes")
+        # the parser is only built, by samplecmdParser(), if samplecmd is used.
+        self.addSubcommand(ctx, "samplecmd", self.samplecmdParser, help="Demo subcmd for sample purposes")
+
+    @traceLog()
+    def samplecmdParser(self, sample_p):
         sample_p.add_argument("--test1", action="store_true", default=False)
         sample_p.add_argument("--test2", action="store_true", default=False)
 
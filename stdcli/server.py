@@ -0,0 +1,294 @@
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:tw=0
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""
+Command server: keeps a fully set up BaseContext, with every plugin loaded
+and every subcommand parser built, and runs commands sent by stdcli.client
+over a Unix socket.
+
+Each command runs in a child forked from the server, so it starts from the
+warm context but cannot change it. The child parses the command line with
+BaseContext.parseCommand() and sends its stdout, stderr and exit code
+back. Stdin is not forwarded.
+
+By default a child is forked for each connection. With prefork=N the server
+keeps N children already forked and waiting in accept(), each runs a single
+command and is replaced when it exits, so fork() is off the request path.
+Waiting children also watch a pipe from the server and exit once it is
+closed, a child running a command finishes it.
+"""
+
+import os
+import sys
+import json
+import errno
+import select
+import signal
+import socket
+import threading
+import traceback
+
+from daemon import Daemon
+from client import writeFrame, STDOUT, STDERR, EXIT
+from trace_decorator import traceLog, getLog
+from log_handlers import flushLogs, exitWhenSafe, exitDone
+
+moduleLog = getLog()
+moduleVerboseLog = getLog(prefix="verbose.")
+
+def _str(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+class CommandServer(Daemon):
+    @traceLog()
+    def __init__(self, ctx, socket_path, backlog=64, prefork=0, **kargs):
+        Daemon.__init__(self, **kargs)
+        self.ctx = ctx
+        self.socket_path = os.path.abspath(socket_path)
+        self.backlog = backlog
+        self.prefork = prefork
+        self.workers = set()
+        self.sock = None
+
+    @traceLog()
+    def warm(self):
+        # build the lazily added subcommand parsers once, not in every child
+        subparsers = self.ctx.subparsers
+        for name in subparsers._name_parser_map.keys():
+            subparsers._get_parser(name)
+
+    @traceLog()
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the owner may run commands
+        umask = os.umask(077)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(self.backlog)
+
+    @traceLog()
+    def run(self):
+        self.warm()
+        self.listen()
+        signal.signal(signal.SIGTERM, self.stop)
+        moduleVerboseLog.info("serving commands on %s" % self.socket_path)
+        try:
+            if self.prefork:
+                self.servePrefork()
+            else:
+                signal.signal(signal.SIGCHLD, self.reap)
+                self.serve()
+        finally:
+            self.sock.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def _accept(self):
+        while True:
+            try:
+                return self.sock.accept()[0]
+            except socket.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def serve(self):
+        while True:
+            conn = self._accept()
+            # a child must not inherit a log writer in the middle of a write
+            flushLogs()
+            pid = os.fork()
+            if pid == 0:
+                # never return into the accept loop from a child
+                code = 1
+                try:
+                    signal.signal(signal.SIGTERM, self.terminate)
+                    self.sock.close()
+                    code = self.handle(conn)
+                finally:
+                    os._exit(code)
+            conn.close()
+
+    def _acceptUnlessStopped(self, stop_fd):
+        """the next connection, or None once stop_fd is closed"""
+        while True:
+            try:
+                readable = select.select([self.sock, stop_fd], [], [])[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if stop_fd in readable:
+                return None
+            try:
+                conn = self.sock.accept()[0]
+            except socket.error, e:
+                # another worker took it
+                if e.args[0] not in (errno.EINTR, errno.EAGAIN):
+                    raise
+                continue
+            conn.setblocking(1)
+            return conn
+
+    def servePrefork(self):
+        # workers wake up together, only one of them gets the connection
+        self.sock.setblocking(0)
+        # the workers see EOF once the server is gone, however it exits
+        stop_read, stop_write = os.pipe()
+        try:
+            while True:
+                while len(self.workers) < self.prefork:
+                    flushLogs()
+                    pid = os.fork()
+                    if pid == 0:
+                        code = 1
+                        try:
+                            self.workers = set()
+                            os.close(stop_write)
+                            signal.signal(signal.SIGTERM, self.terminate)
+                            conn = self._acceptUnlessStopped(stop_read)
+                            if conn is None:
+                                code = 0
+                            else:
+                                os.close(stop_read)
+                                self.sock.close()
+                                code = self.handle(conn)
+                        finally:
+                            os._exit(code)
+                    self.workers.add(pid)
+                try:
+                    pid, status = os.wait()
+                except OSError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+                    continue
+                self.workers.discard(pid)
+        finally:
+            os.close(stop_read)
+            os.close(stop_write)
+
+    def stop(self, signum=None, frame=None):
+        # unwinds run(), which removes the socket
+        sys.exit(0)
+
+    def terminate(self, signum=None, frame=None):
+        # SIGTERM in a child: the command stops like on sys.exit() and the
+        # client gets an exit code. handle() writes the queued log records,
+        # here the interrupted code may hold the lock of a log queue.
+        exitWhenSafe(128 + signal.SIGTERM)
+
+    def reap(self, signum=None, frame=None):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if not pid:
+                return
+
+    def handle(self, conn):
+        """runs in the forked child, returns the exit code"""
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        try:
+            request = json.loads(conn.makefile().readline())
+            argv = [ _str(a) for a in request["argv"] ]
+            os.environ.clear()
+            for key, value in request["env"].items():
+                os.environ[_str(key)] = _str(value)
+            os.chdir(_str(request["cwd"]))
+        except Exception, e:
+            writeFrame(conn, STDERR, "bad request: %s\n" % e)
+            writeFrame(conn, EXIT, "2")
+            return 2
+
+        pump = self.redirectOutput(conn)
+        code = self.execute(argv)
+        exitDone()
+        # os._exit() follows, queued log records are written now
+        flushLogs()
+
+        # closing our end of the pipes lets the pump thread finish
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        pump.join()
+        try:
+            writeFrame(conn, EXIT, str(code))
+        except socket.error:
+            pass
+        return code
+
+    def redirectOutput(self, conn):
+        # stdout and stderr become pipes, a thread copies them to the socket
+        # so everything written to fd 1 and 2, by logging too, is sent
+        channels = {}
+        for fd, channel in ((1, STDOUT), (2, STDERR)):
+            read_fd, write_fd = os.pipe()
+            os.dup2(write_fd, fd)
+            os.close(write_fd)
+            channels[read_fd] = channel
+        pump = threading.Thread(target=self._pump, args=(conn, channels))
+        pump.setDaemon(True)
+        pump.start()
+        return pump
+
+    def _pump(self, conn, channels):
+        while channels:
+            try:
+                readable = select.select(channels.keys(), [], [])[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                data = os.read(fd, 65536)
+                if not data:
+                    os.close(fd)
+                    del(channels[fd])
+                    continue
+                try:
+                    writeFrame(conn, channels[fd], data)
+                except socket.error:
+                    # client went away, keep draining so the command does not block
+                    pass
+
+    def execute(self, argv):
+        ctx = self.ctx
+        try:
+            ctx.parseCommand(argv)
+            ctx.retcode = 0
+            ctx.doCommands()
+            return ctx.retcode
+        except SystemExit, e:
+            if e.code is None:
+                return 0
+            if isinstance(e.code, int):
+                return e.code
+            print >> sys.stderr, e.code
+            return 1
+        except KeyboardInterrupt:
+            return 1
+        except Exception, e:
+            traceback.print_exc()
+            return getattr(ctx, "retcode", 0) or 1
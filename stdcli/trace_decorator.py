@@ -3,10 +3,15 @@
 # Written by Michael Brown
 # Copyright (C) 2007 Michael E Brown <mebrown@michaels-house.net>
 
+import fnmatch
+import json
 import logging
 import os
+import random
 import sys
+import time
 import types
+import weakref
 
 
 import warnings
@@ -20,6 +25,10 @@ try:
 except ImportError:
     from peak_util_decorators import rewrap, decorate
 
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
 
 class NullHandler(logging.Handler):
     def emit(self, record):
@@ -28,11 +37,77 @@ class NullHandler(logging.Handler):
 #initialize this late because if it get initialized but unused we throw an exception on exit
 null_handler = None
 
+# repr() used for traced arguments and results, see setTraceReprLimits()
+traceRepr = repr
+
+class LimitedRepr(reprlib.Repr):
+    """reprlib.Repr bounded by nesting depth and total length only"""
+    def __init__(self, maxlevel=None, maxlength=None):
+        reprlib.Repr.__init__(self)
+        # only limit container sizes through the overall length
+        self.maxtuple = self.maxlist = self.maxarray = self.maxdict = sys.maxint
+        self.maxset = self.maxfrozenset = self.maxdeque = sys.maxint
+        if maxlevel is not None:
+            self.maxlevel = maxlevel
+        self.maxstring = self.maxlong = self.maxother = sys.maxint
+        if maxlength is not None:
+            self.maxstring = self.maxlong = self.maxother = maxlength
+        self.maxlength = maxlength
+
+    def repr(self, x):
+        s = reprlib.Repr.repr(self, x)
+        if self.maxlength is not None and len(s) > self.maxlength:
+            s = s[:max(self.maxlength - 3, 0)] + "..."
+        return s
+
+def setTraceReprLimits(maxlevel=None, maxlength=None):
+    """
+    Limit the nesting depth and the length of each argument and result repr
+    in trace output. With both None (the default) the full repr() is used.
+    Setting only maxlength keeps the reprlib default depth, which also stops
+    runaway recursion.
+    """
+    global traceRepr
+    if maxlevel is None and maxlength is None:
+        traceRepr = repr
+    else:
+        traceRepr = LimitedRepr(maxlevel, maxlength).repr
+
 def format_function_call(func_name, *args, **kw):
     return  "%s(%s)" % (func_name,
-                    ", ".join([repr(i) for i in args] + ["%s=%s" % (key, repr(value)) for key, value in kw.items()])
+                    ", ".join([traceRepr(i) for i in args] + ["%s=%s" % (key, traceRepr(value)) for key, value in kw.items()])
                     )
 
+class TraceMessage(object):
+    """
+    msg object for traceLog() ENTER/LEAVE records. Keeps the raw arguments
+    and result, the string (and every repr in it) is only built when a
+    handler formats the record. LEAVE messages also carry the call duration
+    and the class of the exception raised, if any.
+    """
+    def __init__(self, event, func_name, args=(), kw=None, result=None, module=None, lineno=None, duration=None, exception=None):
+        self.event = event
+        self.func_name = func_name
+        self.args = args
+        self.kw = kw or {}
+        self.result = result
+        self.module = module
+        self.lineno = lineno
+        self.duration = duration
+        self.exception = exception
+        self._str = None
+
+    def __str__(self):
+        if self._str is None:
+            if self.event == "ENTER":
+                self._str = "ENTER %s" % format_function_call(self.func_name, *self.args, **self.kw)
+            else:
+                self._str = "LEAVE %s --> %s\n" % (self.func_name, traceRepr(self.result))
+        return self._str
+
+# every getLog proxy, so invalidateLogCache() can drop what they have cached
+_log_proxies = weakref.WeakKeyDictionary()
+
 # defaults to module log
 # does a late binding on log. Forwards all attributes to logger.
 # works around problem where reconfiguring the logging module means loggers
@@ -44,30 +119,48 @@ class getLog(object):
             frame = sys._getframe(1)
             name = frame.f_globals["__name__"]
         object.__setattr__(self, "name", prefix + name)
+        _log_proxies[self] = None
+
+    # resolve the logger on first use and keep it until invalidateLogCache()
+    def _getLogger(self):
+        logger = self.__dict__.get("_logger")
+        if logger is None:
+            # get logger her so it gets instantiated as late as possible
+            logger = logging.getLogger(self.name)
+            global null_handler
+            if null_handler is None:
+                null_handler = NullHandler()
+            # add null handlers so we can suppress usless "no handlers could be found for..." messages
+            if not null_handler in logger.handlers:
+                logger.addHandler(null_handler)
+            self.__dict__["_logger"] = logger
+        return logger
 
     # forward all attribute access to the logger
     def __getattr__(self, name):
-        # get logger her so it gets instantiated as late as possible
-        logger = logging.getLogger(self.name)
-        global null_handler
-        if null_handler is None:
-            null_handler = NullHandler()
-        # add null handlers so we can suppress usless "no handlers could be found for..." messages
-        if not null_handler in logger.handlers:
-            logger.addHandler(null_handler)
-        return getattr( logger, name )
+        value = getattr(self._getLogger(), name)
+        # bound methods never change, so cache them on the proxy and skip
+        # __getattr__ entirely for later moduleLog.info(...) calls
+        if isinstance(value, types.MethodType):
+            self.__dict__[name] = value
+        return value
 
     # forward all attribute access to the logger
     def __setattr__(self, name, value):
-        # get logger her so it gets instantiated as late as possible
-        logger = logging.getLogger(self.name)
-        global null_handler
-        if null_handler is None:
-            null_handler = NullHandler()
-        # add null handlers so we can suppress usless "no handlers could be found for..." messages
-        if not null_handler in logger.handlers:
-            logger.addHandler(null_handler)
-        return setattr( logger, name, value )
+        self.__dict__.pop(name, None)
+        return setattr( self._getLogger(), name, value )
+
+def invalidateLogCache():
+    """
+    Drop the loggers and methods cached by getLog proxies. Call after the
+    logging config is reloaded (eg. logging.config.fileConfig(), which strips
+    handlers from existing loggers) so the proxies resolve them again.
+    """
+    for proxy in _log_proxies.keys():
+        cache = proxy.__dict__
+        name = cache["name"]
+        cache.clear()
+        cache["name"] = name
 
 
 # emulates logic in logging module to ensure we only log
@@ -82,52 +175,325 @@ def doLog(logger, level, *args, **kargs):
             del(kargs["func"])
             logger.handle(logger.makeRecord(logger.name, level, *args, **kargs))
 
+# precomputed switch consulted by traceLog() wrappers before doing any work.
+# refreshTraceEnabled() recomputes it whenever the logging config changes.
+_trace_enabled = True
+
+def _wouldEmit(logger, level):
+    if logger.disabled or logger.manager.disable >= level or not logger.isEnabledFor(level):
+        return False
+    c = logger
+    while c:
+        for hdlr in c.handlers:
+            if not isinstance(hdlr, NullHandler) and level >= hdlr.level:
+                return True
+        if not c.propagate:
+            break
+        c = c.parent
+    return False
+
+def refreshTraceEnabled(prefix="trace"):
+    """
+    Recompute whether any logger under prefix can emit trace records.
+    Call this after (re)configuring logging. While it is False, traceLog()
+    wrappers using the default trace.<module> loggers call straight through.
+    """
+    global _trace_enabled
+    loggers = [logging.getLogger(prefix)]
+    for name, logger in logging.Logger.manager.loggerDict.items():
+        if name.startswith(prefix + ".") and isinstance(logger, logging.Logger):
+            loggers.append(logger)
+    _trace_enabled = bool([l for l in loggers if _wouldEmit(l, logging.INFO)])
+    return _trace_enabled
+
+def setTraceEnabled(enabled):
+    """Force the traceLog() fast-path switch on or off."""
+    global _trace_enabled
+    _trace_enabled = bool(enabled)
+
+# sampling policy shared by all traceLog() wrappers, see setTraceSampling()
+_sample_every = 1
+_sample_rate = None
+
+def setTraceSampling(every=1, rate=None):
+    """
+    Only trace a subset of the calls to each decorated function: one call in
+    every, and/or at most rate calls per second. Keeps trace volume bounded
+    for long-running daemons. Counting is per function and approximate when
+    the function is called from several threads.
+    """
+    global _sample_every, _sample_rate
+    if every < 1 or (rate is not None and rate <= 0):
+        raise ValueError("trace sampling needs every >= 1 and rate > 0")
+    _sample_every = int(every)
+    _sample_rate = rate and float(rate)
+
+def parseTraceSample(spec):
+    """
+    parse a sampling spec into setTraceSampling() arguments: "N" traces one
+    call in N, "K/s" at most K calls per second, "N,K/s" both.
+    """
+    every, rate = 1, None
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.endswith("/s"):
+            rate = float(part[:-2])
+        else:
+            every = int(part)
+        if every < 1 or (rate is not None and rate <= 0):
+            raise ValueError("invalid trace sample spec: %s" % spec)
+    return every, rate
+
+class _TraceSampler(object):
+    """per function state for trace sampling: call counter and token bucket"""
+    def __init__(self):
+        self.calls = 0
+        self.tokens = 0.0
+        self.stamp = None
+
+    def admit(self):
+        if _sample_every > 1:
+            calls = self.calls
+            self.calls = calls + 1
+            if calls % _sample_every:
+                return False
+        if _sample_rate:
+            now = time.time()
+            capacity = max(_sample_rate, 1.0)
+            if self.stamp is None:
+                self.tokens = capacity
+            else:
+                self.tokens = min(capacity, self.tokens + (now - self.stamp) * _sample_rate)
+            self.stamp = now
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+        return True
+
+# per function timing aggregates gathered by traceLog() wrappers while
+# profiling is enabled, see enableProfiling()
+_profiling = False
+_profile_stats = {}
+
+class FunctionStats(object):
+    """call count, wall time and exception count of one traced function"""
+    # number of durations kept (reservoir sampled) for percentiles
+    max_samples = 1000
+
+    def __init__(self, module, func_name, lineno):
+        self.module = module
+        self.func_name = func_name
+        self.lineno = lineno
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.exceptions = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, elapsed, failed=0):
+        self.calls += 1
+        self.exceptions += failed
+        self.total += elapsed
+        if self.min is None or elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if len(self.samples) < self.max_samples:
+            self.samples.append(elapsed)
+        else:
+            i = random.randrange(self.calls)
+            if i < self.max_samples:
+                self.samples[i] = elapsed
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100.0))]
+
+    def asDict(self):
+        return {
+            "function": "%s.%s" % (self.module, self.func_name),
+            "line": self.lineno,
+            "calls": self.calls,
+            "exceptions": self.exceptions,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            }
+
+def _profileStats(func):
+    key = (func.__module__, func.func_code.co_name, func.func_code.co_firstlineno)
+    stats = _profile_stats.get(key)
+    if stats is None:
+        stats = _profile_stats[key] = FunctionStats(*key)
+    return stats
+
+def _profiledCall(stats, func, args, kw):
+    start = time.time()
+    failed = 1
+    try:
+        result = func(*args, **kw)
+        failed = 0
+        return result
+    finally:
+        stats.add(time.time() - start, failed)
+
+def enableProfiling(enabled=True):
+    """
+    Record call count, wall time and exceptions for every traceLog()
+    decorated function, whether or not trace output is enabled.
+    """
+    global _profiling
+    _profiling = bool(enabled)
+
+def resetProfile():
+    for stats in _profile_stats.values():
+        stats.reset()
+
+def getProfile():
+    """list of FunctionStats for functions called while profiling, busiest first"""
+    result = [ stats for stats in _profile_stats.values() if stats.calls ]
+    result.sort(key=lambda stats: stats.total, reverse=True)
+    return result
+
+def formatProfile(format="table"):
+    """render getProfile() as a text table or as JSON"""
+    profile = [ stats.asDict() for stats in getProfile() ]
+    if format == "json":
+        return json.dumps(profile, indent=1)
+
+    def ms(x):
+        if x is None:
+            return "-"
+        return "%.3f" % (x * 1000)
+    lines = ["%-50s %8s %6s %10s %9s %9s %9s %9s %9s" % ("function (times in ms)", "calls", "exc", "total", "min", "max", "p50", "p90", "p99")]
+    for d in profile:
+        lines.append("%-50s %8d %6d %10s %9s %9s %9s %9s %9s" % (
+            "%s:%d" % (d["function"], d["line"]), d["calls"], d["exceptions"],
+            ms(d["total"]), ms(d["min"]), ms(d["max"]), ms(d["p50"]), ms(d["p90"]), ms(d["p99"])))
+    return "\n".join(lines) + "\n"
+
+# STDCLI_NO_TRACE=1 makes traceLog() return functions undecorated, so there is
+# no per-call overhead at all. Read once, at import time. Functions skipped
+# this way are remembered so retraceModule() can wrap them later on.
+_no_trace = os.environ.get("STDCLI_NO_TRACE", "") not in ("", "0")
+_untraced = weakref.WeakKeyDictionary()
+
 def traceLog(log = None):
     def decorator(func):
-        def trace(*args, **kw):
-            # default to logger that was passed by module, but
-            # can override by passing logger=foo as function parameter.
-            # make sure this doesnt conflict with one of the parameters
-            # you are expecting
-
-            filename = os.path.normcase(func.func_code.co_filename)
-            func_name = func.func_code.co_name
-            lineno = func.func_code.co_firstlineno
-
-            l2 = kw.get('logger', log)
-            if l2 is None:
-                l2 = getLog("trace.%s" % func.__module__)
-            if isinstance(l2, basestring):
-                l2 = getLog(l2)
-
-            message = "ENTER %s" % format_function_call(func_name, *args, **kw)
-
-            frame = sys._getframe(2)
-            doLog(l2, logging.INFO, os.path.normcase(frame.f_code.co_filename), frame.f_lineno, message, args=[], exc_info=None, func=frame.f_code.co_name)
-            try:
-                result = "Bad exception raised: Exception was not a derived class of 'Exception'"
-                try:
-                    result = func(*args, **kw)
-                except (SystemExit, KeyboardInterrupt), e:
-                    result = "SYSTEM EXIT or KEYBOARD INTERRUPT: %s" % e.__class__
-                    # only print stack trace once when we catch this
-                    if not hasattr(e, "already_printed"):
-                        doLog(l2, logging.INFO, filename, lineno, "SYSTEM EXIT or KEYBOARD INTERRUPT: %s\n" % e, args=[], exc_info=sys.exc_info(), func=func_name)
-                        e.already_printed = 1
-                    raise
-                except (Exception), e:
-                    result = "EXCEPTION RAISED: %s" % e.__class__
-                    if not hasattr(e, "already_printed"):
-                        doLog(l2, logging.INFO, filename, lineno, "EXCEPTION: %s\n" % e, args=[], exc_info=sys.exc_info(), func=func_name)
-                        e.already_printed = 1
-                    raise
-            finally:
-                doLog(l2, logging.INFO, filename, lineno, "LEAVE %s --> %s\n" % (func_name, repr(result)), args=[], exc_info=None, func=func_name)
-
-            return result
-        return rewrap(func, trace)
+        if _no_trace:
+            _untraced[func] = log
+            return func
+        return _traceWrapper(func, log)
     return decorator
 
+def _retrace(func):
+    log = _untraced.pop(func)
+    return _traceWrapper(func, log)
+
+def retraceModule(module):
+    """
+    Apply the traceLog() decorations that were skipped in STDCLI_NO_TRACE mode
+    to the functions and class methods of an already imported module. Only
+    affects lookups made after this call; references that were already bound
+    keep calling the undecorated function.
+    """
+    if isinstance(module, basestring):
+        module = sys.modules.get(module)
+    if module is None or not _untraced:
+        return
+    for name, obj in vars(module).items():
+        if isinstance(obj, types.FunctionType) and obj in _untraced:
+            setattr(module, name, _retrace(obj))
+        elif isinstance(obj, (type, types.ClassType)) and obj.__module__ == module.__name__:
+            for attr, value in obj.__dict__.items():
+                if isinstance(value, types.FunctionType) and value in _untraced:
+                    setattr(obj, attr, _retrace(value))
+                elif isinstance(value, (staticmethod, classmethod)) and value.__func__ in _untraced:
+                    setattr(obj, attr, value.__class__(_retrace(value.__func__)))
+
+def retraceModules(*patterns):
+    """retraceModule() every loaded module whose name matches a glob pattern"""
+    for name, module in sys.modules.items():
+        for pattern in patterns:
+            if module is not None and fnmatch.fnmatch(name, pattern):
+                retraceModule(module)
+                break
+
+def _traceWrapper(func, log):
+    filename = os.path.normcase(func.func_code.co_filename)
+    func_name = func.func_code.co_name
+    lineno = func.func_code.co_firstlineno
+    module = func.__module__
+    default_log = getLog("trace.%s" % module)
+    sampler = _TraceSampler()
+    stats = _profileStats(func)
+
+    def trace(*args, **kw):
+        # default to logger that was passed by module, but
+        # can override by passing logger=foo as function parameter.
+        # make sure this doesnt conflict with one of the parameters
+        # you are expecting
+        l2 = kw.get('logger', log)
+        if l2 is None:
+            if _trace_enabled:
+                l2 = default_log
+        elif isinstance(l2, basestring):
+            l2 = getLog(l2)
+
+        if l2 is None or not l2.isEnabledFor(logging.INFO) or \
+                ((_sample_every > 1 or _sample_rate) and not sampler.admit()):
+            if _profiling:
+                return _profiledCall(stats, func, args, kw)
+            return func(*args, **kw)
+
+        message = TraceMessage("ENTER", func_name, args, kw, module=module, lineno=lineno)
+
+        frame = sys._getframe(2)
+        doLog(l2, logging.INFO, os.path.normcase(frame.f_code.co_filename), frame.f_lineno, message, args=[], exc_info=None, func=frame.f_code.co_name)
+        start = time.time()
+        failed = 1
+        exception = None
+        try:
+            result = "Bad exception raised: Exception was not a derived class of 'Exception'"
+            try:
+                result = func(*args, **kw)
+                failed = 0
+            except (SystemExit, KeyboardInterrupt), e:
+                exception = e.__class__
+                result = "SYSTEM EXIT or KEYBOARD INTERRUPT: %s" % e.__class__
+                # only print stack trace once when we catch this
+                if not hasattr(e, "already_printed"):
+                    doLog(l2, logging.INFO, filename, lineno, "SYSTEM EXIT or KEYBOARD INTERRUPT: %s\n" % e, args=[], exc_info=sys.exc_info(), func=func_name)
+                    e.already_printed = 1
+                raise
+            except (Exception), e:
+                exception = e.__class__
+                result = "EXCEPTION RAISED: %s" % e.__class__
+                if not hasattr(e, "already_printed"):
+                    doLog(l2, logging.INFO, filename, lineno, "EXCEPTION: %s\n" % e, args=[], exc_info=sys.exc_info(), func=func_name)
+                    e.already_printed = 1
+                raise
+        finally:
+            duration = time.time() - start
+            if _profiling:
+                stats.add(duration, failed)
+            message = TraceMessage("LEAVE", func_name, result=result, module=module, lineno=lineno, duration=duration, exception=exception)
+            doLog(l2, logging.INFO, filename, lineno, message, args=[], exc_info=None, func=func_name)
+
+        return result
+    return rewrap(func, trace)
+
 # helper function so we can use back-compat format but not be ugly
 def decorateAllFunctions(module, logger=None):
     methods = [ method for method in dir(module)
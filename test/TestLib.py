@@ -4,8 +4,22 @@
 
 #alphabetical order
 import os
+import atexit
+import shutil
+import tempfile
 import unittest
 
+# the tests build entry point and completion caches, keep them out of
+# ~/.cache/stdcli. set before any test imports stdcli.
+cacheDir = tempfile.mkdtemp(prefix="stdcli-test-cache-")
+os.environ["STDCLI_CACHE_DIR"] = cacheDir
+
+def _removeCacheDir(pid=os.getpid()):
+    # not from the forked children of the tests
+    if os.getpid() == pid:
+        shutil.rmtree(cacheDir, True)
+atexit.register(_removeCacheDir)
+
 def usage():
     print "wrong command line options." #need better help eventually
 
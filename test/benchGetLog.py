@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+# VIM declarations
+# vim:tw=0:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+
+"""
+microbenchmark for getLog proxies: calls per second of moduleLog.debug()
+on a disabled logger, before (uncached proxy) and after (cached proxy).
+"""
+
+import os
+import sys
+import time
+import logging
+
+exeName = os.path.realpath(sys.argv[0])
+top_srcdir = os.path.join(os.path.dirname(exeName), "..")
+sys.path.insert(0,top_srcdir)
+
+from stdcli import trace_decorator
+
+# the getLog implementation prior to caching resolved loggers
+class UncachedLog(object):
+    def __init__(self, name):
+        object.__setattr__(self, "name", name)
+
+    def __getattr__(self, name):
+        logger = logging.getLogger(self.name)
+        if trace_decorator.null_handler is None:
+            trace_decorator.null_handler = trace_decorator.NullHandler()
+        if not trace_decorator.null_handler in logger.handlers:
+            logger.addHandler(trace_decorator.null_handler)
+        return getattr( logger, name )
+
+def callsPerSecond(log, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        log.debug("message")
+    return iterations / (time.time() - start)
+
+if __name__ == "__main__":
+    iterations = 200000
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+
+    logging.getLogger().setLevel(logging.WARNING)
+    before = callsPerSecond(UncachedLog("bench.getlog"), iterations)
+    after = callsPerSecond(trace_decorator.getLog("bench.getlog"), iterations)
+
+    print "uncached getLog: %12.0f calls/sec" % before
+    print "cached getLog:   %12.0f calls/sec" % after
+    print "speedup:         %12.2fx" % (after / before)
@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# VIM declarations
+# vim:tw=0:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+
+"""
+command latency benchmark: cold start against the command server.
+
+Uses the synthetic application of benchStartup.py with 1/10/100/1000
+plugins and times one command three ways:
+
+  cold     a fresh interpreter running the application
+  fork     stdcli.client.runCommand() against a server forking per command
+  prefork  the same against a server with a pool of pre-forked children
+
+Client side latency is measured in this process, so interpreter startup of
+the client is not included for fork/prefork; see "client_start" for what a
+stdcli-client process adds. Prints one JSON object per plugin count, with
+the median and minimum in seconds.
+
+usage: benchServer.py [--plugins 1,10,100,1000] [--repeat 20] [--prefork 4]
+                      [--output FILE]
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import signal
+import tempfile
+import optparse
+import subprocess
+from cStringIO import StringIO
+
+import benchStartup
+
+exeName = os.path.realpath(sys.argv[0])
+top_srcdir = os.path.join(os.path.dirname(exeName), "..")
+sys.path.insert(0, top_srcdir)
+
+def serve(config, socket_path, prefork):
+    import stdcli.cli_main
+    import stdcli.server
+    stdcli.cli_main.moduleName = benchStartup.APP
+    stdcli.cli_main.__VERSION__ = "1.0"
+    ctx = stdcli.cli_main.BaseContext(prog=benchStartup.APP, args=["-c", config, "cmd0000"])
+    stdcli.server.CommandServer(ctx, socket_path, prefork=prefork, foreground=True).start()
+
+def environment(topdir):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([topdir, top_srcdir, env.get("PYTHONPATH", "")])
+    env["STDCLI_CACHE_DIR"] = topdir + ".cache"
+    return env
+
+def startServer(topdir, config, prefork):
+    socket_path = os.path.join(topdir + ".cache", "server-%s.sock" % prefork)
+    argv = [sys.executable, exeName, "--serve", config, "--socket", socket_path, "--prefork", str(prefork)]
+    process = subprocess.Popen(argv, env=environment(topdir), cwd=topdir)
+    for i in range(600):
+        if os.path.exists(socket_path):
+            break
+        time.sleep(0.05)
+    else:
+        process.kill()
+        raise RuntimeError("server did not start: %s" % " ".join(argv))
+    return process, socket_path
+
+def stopServer(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait()
+
+def timeCold(topdir, config):
+    argv = [sys.executable, os.path.join(os.path.dirname(exeName), "benchStartup.py"), "--child", config, "--", "cmd0000"]
+    start = time.time()
+    subprocess.check_call(argv, stdout=open(os.devnull, "w"), env=environment(topdir), cwd=topdir)
+    return time.time() - start
+
+def timeServer(socket_path, env):
+    import stdcli.client
+    start = time.time()
+    code = stdcli.client.runCommand(socket_path, ["cmd0000"], env=env, stdout=StringIO(), stderr=StringIO())
+    if code:
+        raise RuntimeError("server command failed: %s" % code)
+    return time.time() - start
+
+def timeClientStart():
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", "import stdcli.client"], env=dict(os.environ, PYTHONPATH=top_srcdir))
+    return time.time() - start
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {"median": samples[len(samples) // 2], "min": samples[0]}
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--plugins", default="1,10,100,1000")
+    parser.add_option("--repeat", type="int", default=20)
+    parser.add_option("--prefork", type="int", default=4)
+    parser.add_option("--output", default=None)
+    parser.add_option("--serve", default=None)
+    parser.add_option("--socket", default=None)
+    opts, args = parser.parse_args()
+
+    if opts.serve:
+        return serve(opts.serve, opts.socket, opts.prefork)
+
+    out = sys.stdout
+    if opts.output:
+        out = open(opts.output, "w")
+
+    for plugins in [ int(i) for i in opts.plugins.split(",") ]:
+        topdir = tempfile.mkdtemp(prefix="stdcli-bench-")
+        servers = []
+        try:
+            config = benchStartup.makeApp(topdir, plugins, 1)
+            env = environment(topdir)
+            result = {}
+
+            # warm up .pyc files and the entry point cache
+            timeCold(topdir, config)
+            result["cold"] = summarize([ timeCold(topdir, config) for i in range(opts.repeat) ])
+
+            for mode, prefork in (("fork", 0), ("prefork", opts.prefork)):
+                process, socket_path = startServer(topdir, config, prefork)
+                servers.append(process)
+                timeServer(socket_path, env)
+                result[mode] = summarize([ timeServer(socket_path, env) for i in range(opts.repeat) ])
+                stopServer(process)
+                servers.remove(process)
+
+            result["client_start"] = summarize([ timeClientStart() for i in range(opts.repeat) ])
+            out.write(json.dumps({
+                "plugins": plugins,
+                "repeat": opts.repeat,
+                "prefork": opts.prefork,
+                "python": sys.version.split()[0],
+                "latency": result,
+                }, sort_keys=True) + "\n")
+            out.flush()
+        finally:
+            for process in servers:
+                stopServer(process)
+            shutil.rmtree(topdir)
+            shutil.rmtree(topdir + ".cache", ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
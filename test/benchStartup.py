@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+# VIM declarations
+# vim:tw=0:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+
+"""
+startup latency benchmark for the stdcli entry path.
+
+Builds a synthetic stdcli application with 1/10/100/1000 plugin entry points
+and a synthetic config file, then runs it in fresh interpreters and times
+the import of stdcli plus each BaseContext startup phase (see
+BaseContext.timings). Prints one JSON object per configuration, with the
+median and minimum of every phase in seconds.
+
+usage: benchStartup.py [--plugins 1,10,100,1000] [--config-sections 1,100]
+                       [--repeat 5] [--lazy] [--output FILE]
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+exeName = os.path.realpath(sys.argv[0])
+top_srcdir = os.path.join(os.path.dirname(exeName), "..")
+
+APP = "synthbench"
+
+PLUGIN_TEMPLATE = """
+from stdcli.plugin import Plugin
+
+class SynthPlugin(Plugin):
+    def __init__(self, ctx):
+        self.addSubcommand(ctx, "%(cmd)s", self.setupParser, help="synthetic command %(cmd)s")
+
+    def setupParser(self, p):
+        p.add_argument("--opt-a", action="store_true", default=False)
+        p.add_argument("--opt-b", action="store", default=None)
+        p.add_argument("items", nargs="*")
+        p.set_defaults(func=self.run)
+
+    def run(self, ctx):
+        pass
+"""
+
+def makeApp(topdir, plugins, config_sections):
+    pkgdir = os.path.join(topdir, APP)
+    os.makedirs(os.path.join(pkgdir, "plugins"))
+    open(os.path.join(pkgdir, "__init__.py"), "w").close()
+    open(os.path.join(pkgdir, "plugins", "__init__.py"), "w").close()
+    open(os.path.join(pkgdir, "%s.ini" % APP), "w").write("[general]\nverbosity: 1\n")
+
+    extensions = []
+    commands = []
+    for i in range(plugins):
+        name = "p%04d" % i
+        cmd = "cmd%04d" % i
+        open(os.path.join(pkgdir, "plugins", "%s.py" % name), "w").write(PLUGIN_TEMPLATE % {"cmd": cmd})
+        extensions.append("%s = %s.plugins.%s:SynthPlugin" % (name, APP, name))
+        commands.append("%s = %s.plugins.%s:SynthPlugin" % (cmd, APP, name))
+
+    egginfo = os.path.join(topdir, "%s.egg-info" % APP)
+    os.makedirs(egginfo)
+    open(os.path.join(egginfo, "PKG-INFO"), "w").write("Metadata-Version: 1.0\nName: %s\nVersion: 1.0\n" % APP)
+    open(os.path.join(egginfo, "entry_points.txt"), "w").write(
+        "[%s_cli_extensions]\n%s\n\n[%s_cli_commands]\n%s\n" % (APP, "\n".join(extensions), APP, "\n".join(commands)))
+
+    config = os.path.join(topdir, "bench.ini")
+    fd = open(config, "w")
+    fd.write("[general]\nverbosity: 1\n")
+    for i in range(config_sections):
+        fd.write("\n[section%04d]\n" % i)
+        for j in range(10):
+            fd.write("option%02d: value %d %d\n" % (j, i, j))
+    fd.close()
+    return config
+
+def child(config, argv):
+    start = time.time()
+    import stdcli.cli_main
+    timings = [("import", time.time() - start)]
+    stdcli.cli_main.moduleName = APP
+    stdcli.cli_main.__VERSION__ = "1.0"
+    ctx = stdcli.cli_main.BaseContext(prog=APP, args=["-c", config] + argv)
+    timings.extend(ctx.timings)
+    phase_start = time.time()
+    ctx.doCommands()
+    timings.append(("do_commands", time.time() - phase_start))
+    timings.append(("total", time.time() - start))
+    print json.dumps(timings)
+
+def runOnce(topdir, config, lazy):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([topdir, top_srcdir, env.get("PYTHONPATH", "")])
+    # outside topdir, creating it must not change the sys.path fingerprint
+    env["STDCLI_CACHE_DIR"] = topdir + ".cache"
+    argv = [sys.executable, exeName, "--child", config, "--"]
+    if lazy:
+        argv.append("--lazy-plugins")
+    argv.append("cmd0000")
+    start = time.time()
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, env=env, cwd=topdir)
+    output = process.communicate()[0]
+    wall = time.time() - start
+    if process.returncode:
+        raise RuntimeError("benchmark child failed: %s" % " ".join(argv))
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings.append(["wall", wall])
+    return timings
+
+def summarize(runs):
+    phases = [ phase for phase, t in runs[0] ]
+    result = {}
+    for phase in phases:
+        samples = sorted([ dict(run)[phase] for run in runs ])
+        result[phase] = {"median": samples[len(samples) // 2], "min": samples[0]}
+    return result
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--plugins", default="1,10,100,1000")
+    parser.add_option("--config-sections", default="1,100")
+    parser.add_option("--repeat", type="int", default=5)
+    parser.add_option("--lazy", action="store_true", default=False, help="also measure --lazy-plugins")
+    parser.add_option("--output", default=None)
+    parser.add_option("--child", default=None)
+    opts, args = parser.parse_args()
+
+    if opts.child:
+        return child(opts.child, args)
+
+    out = sys.stdout
+    if opts.output:
+        out = open(opts.output, "w")
+
+    modes = [False]
+    if opts.lazy:
+        modes.append(True)
+
+    for plugins in [ int(i) for i in opts.plugins.split(",") ]:
+        for sections in [ int(i) for i in opts.config_sections.split(",") ]:
+            topdir = tempfile.mkdtemp(prefix="stdcli-bench-")
+            try:
+                config = makeApp(topdir, plugins, sections)
+                for lazy in modes:
+                    # warm up .pyc files and the entry point cache
+                    runOnce(topdir, config, lazy)
+                    runs = [ runOnce(topdir, config, lazy) for i in range(opts.repeat) ]
+                    out.write(json.dumps({
+                        "plugins": plugins,
+                        "config_sections": sections,
+                        "lazy_plugins": lazy,
+                        "repeat": opts.repeat,
+                        "python": sys.version.split()[0],
+                        "phases": summarize(runs),
+                        }, sort_keys=True) + "\n")
+                    out.flush()
+            finally:
+                shutil.rmtree(topdir)
+                shutil.rmtree(topdir + ".cache", ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
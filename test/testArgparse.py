@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.argparse
+        self.argparse = stdcli.argparse
+
+    def testOptionPrefixes(self):
+        p = self.argparse.ArgumentParser(add_help=False, conflict_handler="resolve")
+        p.add_argument("--trace", action="store_true")
+        p.add_argument("--trace-off", action="store_false", dest="trace")
+        p.add_argument("--logfile")
+        p.add_argument("-f", "--foo")
+        p.add_argument("-foobar", dest="foobar")
+        p.add_argument("--lockfile")
+
+        self.assertEqual(p.parse_args(["--log=a"]).logfile, "a")
+        self.assertEqual(p.parse_args(["--trace-o"]).trace, False)
+        self.assertEqual(p.parse_args(["-fx"]).foo, "x")
+        self.assertEqual(p.parse_args(["-foobar", "x"]).foobar, "x")
+        self.assertEqual(p._get_option_tuples("--tr"), [(p._option_string_actions["--trace"], "--trace", None), (p._option_string_actions["--trace-off"], "--trace-off", None)])
+        self.assertEqual(p._get_option_tuples("--nothing"), [])
+
+        # ambiguous prefixes are still an error
+        saved = sys.stderr
+        sys.stderr = open(os.devnull, "w")
+        try:
+            self.assertRaises(SystemExit, p.parse_args, ["--l", "a"])
+            # -f with an argument, or an abbreviation of -foobar
+            self.assertRaises(SystemExit, p.parse_args, ["-foob", "x"])
+        finally:
+            sys.stderr = saved
+
+        # the index follows conflict resolution
+        p.add_argument("--lockfile", dest="other")
+        self.assertEqual(p._option_string_index.count("--lockfile"), 1)
+        self.assertEqual(p.parse_args(["--lock", "a"]).other, "a")
+        p.add_argument("--foo", dest="foo2")
+        self.assertEqual(p.parse_args(["-fx"]).foo, "x")
+        self.assertEqual(p.parse_args(["--foo", "x"]).foo2, "x")
+        self.assertEqual(p._option_string_index, sorted(p._option_string_actions.keys()))
+        # arg strings are classified once per parse, nothing is kept after
+        self.assertEqual(p._parse_optional_cache, None)
+
+    def testNargsMatching(self):
+        argparse = self.argparse
+        p = argparse.ArgumentParser(add_help=False)
+        patterns = [""]
+        for i in range(4):
+            patterns = patterns + [ x + c for x in patterns for c in "AO-" if len(x) == i ]
+        for nargs in (None, argparse.OPTIONAL, argparse.ZERO_OR_MORE, argparse.ONE_OR_MORE, argparse.REMAINDER, argparse.PARSER, 0, 1, 2):
+            action = argparse.Action(["--opt"], "opt", nargs=nargs)
+            regex = p._get_nargs_pattern(action)
+            for pattern in patterns:
+                match = argparse._re.match(regex, pattern)
+                expected = match and len(match.group(1))
+                self.assertEqual(p._match_optional_nargs(nargs, pattern), expected, (nargs, pattern))
+
+        p.add_argument("a")
+        p.add_argument("b", nargs="*")
+        p.add_argument("c", nargs=2)
+        self.assertEqual(p.parse_args(["1", "2", "3", "4", "5"]).b, ["2", "3"])
+        self.assertEqual(len(p._nargs_regex_cache), 1)
+        p.parse_args(["1", "2", "3"])
+        self.assertEqual(len(p._nargs_regex_cache), 1)
+
+    def testFromFile(self):
+        tmpdir = tempfile.mkdtemp()
+        saved = sys.stderr
+        try:
+            def write(name, *lines):
+                open(os.path.join(tmpdir, name), "w").write("".join([ l + "\n" for l in lines ]))
+                return "@" + os.path.join(tmpdir, name)
+            hosts = write("hosts", "host1", "host2", write("more", "host3"), "host4")
+
+            p = self.argparse.ArgumentParser(add_help=False, fromfile_prefix_chars="@")
+            p.add_argument("-v", action="store_true")
+            p.add_argument("hosts", nargs="*")
+            args = p.parse_args([write("opts", "-v"), hosts, "host5"])
+            self.assertEqual(args.v, True)
+            self.assertEqual(args.hosts, ["host1", "host2", "host3", "host4", "host5"])
+
+            # a lazy positional gets an iterator, the files are read as it is consumed
+            p = self.argparse.ArgumentParser(add_help=False, fromfile_prefix_chars="@")
+            p.add_argument("-v", action="store_true")
+            p.add_argument("hosts", action="iter_fromfile")
+            args = p.parse_args(["-v", "host0", hosts])
+            self.failIf(isinstance(args.hosts, list))
+            write("more", "host3a", "host3b")
+            self.assertEqual(list(args.hosts), ["host0", "host1", "host2", "host3a", "host3b", "host4"])
+            self.assertEqual(list(p.parse_args([]).hosts), [])
+
+            # other file references are still expanded up front
+            args = p.parse_args([write("opts", "-v"), hosts])
+            self.assertEqual(args.v, True)
+            self.assertEqual(list(args.hosts), ["host1", "host2", "host3a", "host3b", "host4"])
+            p = self.argparse.ArgumentParser(add_help=False, fromfile_prefix_chars="@")
+            p.add_argument("-v", action="store_true")
+            p.add_argument("--hosts", action="iter_fromfile")
+            p.add_argument("rest", nargs="*")
+            args = p.parse_args(["--hosts", hosts, write("opts", "-v", "x")])
+            self.assertEqual((args.v, args.rest), (True, ["x"]))
+            self.assertEqual(list(args.hosts), ["host1", "host2", "host3a", "host3b", "host4"])
+            self.assertEqual(list(p.parse_args(["--hosts=" + hosts]).hosts)[:1], ["host1"])
+
+            # only a file in the place of the positional's values is left lazy
+            p = self.argparse.ArgumentParser(add_help=False, fromfile_prefix_chars="@")
+            p.add_argument("--opt")
+            p.add_argument("cmd")
+            p.add_argument("hosts", action="iter_fromfile")
+            args = p.parse_args([write("cmdline", "run", "h1", "h2")])
+            self.assertEqual((args.cmd, list(args.hosts)), ("run", ["h1", "h2"]))
+            args = p.parse_args(["--opt", write("value", "x"), "run", hosts])
+            self.assertEqual((args.opt, args.cmd), ("x", "run"))
+            self.failIf(isinstance(args.hosts, list))
+            self.assertEqual(list(args.hosts), ["host1", "host2", "host3a", "host3b", "host4"])
+
+            sys.stderr = open(os.devnull, "w")
+            loop = write("loop", "a", "@" + os.path.join(tmpdir, "loop2"))
+            write("loop2", "b", loop)
+            self.assertRaises(SystemExit, p._read_args_from_files, [loop])
+            self.assertRaises(SystemExit, p._read_args_from_files, ["@" + os.path.join(tmpdir, "missing")])
+            # a missing file is reported by the parse, not while iterating
+            self.assertRaises(SystemExit, p.parse_args, ["--hosts", "@" + os.path.join(tmpdir, "missing")])
+        finally:
+            sys.stderr = saved
+            shutil.rmtree(tmpdir)
+
+    def testLazySubparsers(self):
+        p = self.argparse.ArgumentParser(prog="prog", add_help=False)
+        subparsers = p.add_subparsers(dest="command")
+        built = []
+        def setup(name):
+            def setup(parser):
+                built.append(name)
+                parser.add_argument("--%s-opt" % name, action="store_true")
+            return setup
+        subparsers.add_lazy_parser("one", setup("one"), help="first")
+        subparsers.add_lazy_parser("two", setup("two"), help="second")
+        self.failUnless("one" in p.format_help() and "second" in p.format_help())
+        self.assertEqual(built, [])
+
+        args = p.parse_args(["two", "--two-opt"])
+        self.assertEqual((args.command, args.two_opt), ("two", True))
+        self.assertEqual(built, ["two"])
+        self.assertEqual(subparsers._get_parser("two").prog, "prog two")
+        p.parse_args(["two"])
+        self.assertEqual(built, ["two"])
+
+    def testHelpCache(self):
+        p = self.argparse.ArgumentParser(prog="prog")
+        p.add_argument("--foo", help="foo help")
+        help = p.format_help()
+        self.failUnless(p.format_help() is help)
+        self.failUnless(p.format_usage() is p.format_usage())
+
+        # adding arguments or subcommands, or changing the width, renders again
+        p.add_argument("--bar")
+        self.failUnless("--bar" in p.format_help())
+        subparsers = p.add_subparsers()
+        subparsers.add_parser("one")
+        self.failUnless("{one}" in p.format_usage())
+        subparsers.add_parser("two")
+        self.failUnless("two" in p.format_usage())
+        saved = os.environ.get("COLUMNS")
+        os.environ["COLUMNS"] = "30"
+        try:
+            self.failUnless(p.format_help() is not help)
+            self.assertEqual(p.format_help(), p._render_help())
+        finally:
+            if saved is None:
+                del(os.environ["COLUMNS"])
+            else:
+                os.environ["COLUMNS"] = saved
+
+        # the key is the same in another process, and differs by locale
+        p = self.argparse.ArgumentParser(prog="prog")
+        p.add_argument("--obj", default=object())
+        p2 = self.argparse.ArgumentParser(prog="prog")
+        p2.add_argument("--obj", default=object())
+        key = p._get_format_key()
+        self.assertEqual(key, p2._get_format_key())
+        saved = os.environ.get("LANGUAGE")
+        os.environ["LANGUAGE"] = "xx_test"
+        try:
+            self.assertNotEqual(p._get_format_key(), key)
+        finally:
+            if saved is None:
+                del(os.environ["LANGUAGE"])
+            else:
+                os.environ["LANGUAGE"] = saved
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
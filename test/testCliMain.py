@@ -0,0 +1,218 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.cli_main
+        self.cli_main = stdcli.cli_main
+
+    def testFindCommandName(self):
+        find = self.cli_main.findCommandName
+        self.assertEqual(find(["samplecmd", "--test1"]), "samplecmd")
+        self.assertEqual(find(["--foo", "samplecmd"]), "samplecmd")
+        self.assertEqual(find(["--", "samplecmd"]), "samplecmd")
+        self.assertEqual(find(["--help", "samplecmd"]), None)
+        self.assertEqual(find(["samplecmd", "--help"]), "samplecmd")
+        self.assertEqual(find([]), None)
+
+    def testPreScan(self):
+        import stdcli.argparse as argparse
+        p = argparse.ArgumentParser(add_help=False)
+        config = p.add_argument("-c", "--config", dest="config_files", action="append")
+        none = p.add_argument("--no-default-config", dest="config_files", action="store_const", const=[])
+        p.add_argument("-v", "--verbose", action="count", dest="verbosity")
+        found, rest = self.cli_main.preScan(p, ["-v", "-c", "a", "cmd", "--conf=b", "--no-default-config", "-cc", "--", "-c", "d"], [config, none])
+        self.assertEqual([ (a, o, v) for a, o, v in found ], [(config, "-c", "a"), (config, "--config", "b"), (none, "--no-default-config", []), (config, "-c", "c")])
+        self.assertEqual(rest, ["-v", "cmd", "--", "-c", "d"])
+
+    def testHelpTextCache(self):
+        import stdcli.argparse as argparse
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "help.json")
+            p = argparse.ArgumentParser(prog="prog")
+            p.add_argument("--foo", help="foo help")
+            p._format_cache = self.cli_main.HelpTextCache(filename)
+            help = p.format_help()
+            self.failUnless(os.path.exists(filename))
+
+            # a new process with the same parser gets the saved text
+            p2 = argparse.ArgumentParser(prog="prog")
+            p2.add_argument("--foo", help="foo help")
+            p2._format_cache = self.cli_main.HelpTextCache(filename)
+            p2._render_help = None
+            self.assertEqual(p2.format_help(), help)
+            p2.add_argument("--bar")
+            self.assertRaises(TypeError, p2.format_help)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testConfigureLogging(self):
+        import ConfigParser
+        import logging
+        from cStringIO import StringIO
+        root = logging.getLogger()
+        saved = (root.handlers[:], root.level, dict([ (n, l.disabled) for n, l in logging.Logger.manager.loggerDict.items() if isinstance(l, logging.Logger) ]))
+        try:
+            conf = ConfigParser.ConfigParser()
+            self.failIf(self.cli_main.configureLogging(conf))
+
+            conf.readfp(StringIO("[general]\nverbosity: 1\n\n[formatters]\nkeys: plain\n[formatter_plain]\nformat: >%(message)s\n"
+                "[handlers]\nkeys: out\n[handler_out]\nclass: StreamHandler\nformatter: plain\nargs: (sys.stderr,)\n"
+                "[loggers]\nkeys: root\n[logger_root]\nlevel: WARNING\nhandlers: out\n"))
+            self.failUnless(self.cli_main.configureLogging(conf))
+            self.assertEqual(root.level, logging.WARNING)
+            self.assertEqual(len(root.handlers), 1)
+            self.assertEqual(root.handlers[0].formatter._fmt, ">%(message)s")
+
+            conf.add_section("logging")
+            conf.set("logging", "dictconfig", '{"version": 1, "disable_existing_loggers": false, '
+                '"formatters": {"f": {"format": "%(levelname)s %(message)s"}}, '
+                '"handlers": {"h": {"class": "logging.StreamHandler", "formatter": "f", "stream": "ext://sys.stderr"}}, '
+                '"root": {"level": "INFO", "handlers": ["h"]}}')
+            self.failUnless(self.cli_main.configureLogging(conf))
+            self.assertEqual(root.level, logging.INFO)
+            self.assertEqual(root.handlers[0].formatter._fmt, "%(levelname)s %(message)s")
+        finally:
+            root.handlers[:] = saved[0]
+            root.setLevel(saved[1])
+            for name, disabled in saved[2].items():
+                logging.Logger.manager.loggerDict[name].disabled = disabled
+
+    def testSigtermAsyncLogging(self):
+        import time
+        import logging
+        import stdcli.log_handlers
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for i in range(30):
+                filename = os.path.join(tmpdir, "log%d" % i)
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        os.close(read_fd)
+                        # an exit dropped in a finalizer is reported there
+                        os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+                        logger = logging.getLogger("sigtermtest")
+                        logger.propagate = 0
+                        logger.setLevel(logging.INFO)
+                        logger.handlers = [logging.StreamHandler(open(filename, "w"))]
+                        stdcli.log_handlers.makeAsync([logger])
+                        signal.signal(signal.SIGTERM, self.cli_main.sigterm)
+                        count = 0
+                        try:
+                            os.write(write_fd, "x")
+                            while True:
+                                logger.info("line")
+                                count += 1
+                        finally:
+                            # like main() on the way out
+                            stdcli.log_handlers.exitDone()
+                            stdcli.log_handlers.flushLogs()
+                            os.write(write_fd, "%d" % count)
+                    finally:
+                        os._exit(0)
+                os.close(write_fd)
+                try:
+                    self.assertEqual(os.read(read_fd, 1), "x")
+                    time.sleep(0.003 * i)
+                    os.kill(pid, signal.SIGTERM)
+                    for j in range(100):
+                        if os.waitpid(pid, os.WNOHANG)[0]:
+                            break
+                        time.sleep(0.05)
+                    else:
+                        os.kill(pid, signal.SIGKILL)
+                        os.waitpid(pid, 0)
+                        self.fail("SIGTERM while logging hung the process")
+                    count = int(os.read(read_fd, 100))
+                finally:
+                    os.close(read_fd)
+                # a record may be logged without being counted
+                lines = open(filename).read().count("\n")
+                self.failUnless(count <= lines <= count + 1, (count, lines))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testLockWait(self):
+        import time
+        import stdcli.argparse as argparse
+        tmpdir = tempfile.mkdtemp()
+        def context():
+            ctx = self.cli_main.BaseContext.__new__(self.cli_main.BaseContext)
+            ctx.args = argparse.Namespace(lockfile=os.path.join(tmpdir, "lock"), lock_timeout=None)
+            ctx.runLock = None
+            return ctx
+        # the holder says when it has the lock, and releases it when told
+        locked_read, locked_write = os.pipe()
+        release_read, release_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(locked_read)
+                os.close(release_write)
+                holder = context()
+                holder.lock()
+                os.write(locked_write, "x")
+                os.read(release_read, 1)
+                time.sleep(0.2)
+                os.write(locked_write, "%r" % time.time())
+                holder.unlock()
+            finally:
+                os._exit(0)
+        # a holder that fails closes the pipes, nothing waits forever
+        os.close(locked_write)
+        os.close(release_read)
+        try:
+            self.assertEqual(os.read(locked_read, 1), "x")
+            waiter = context()
+            try:
+                waiter.lock()
+                self.fail("lock held by %s was taken" % pid)
+            except self.cli_main.LockError, e:
+                self.failUnless(("Locked by PID: %s" % pid) in str(e))
+            start = time.time()
+            self.assertRaises(self.cli_main.LockError, waiter.doLockLoop, 0.1)
+            self.failUnless(0.1 <= time.time() - start < 5)
+
+            # an itimer someone else has set is left alone
+            handler = lambda signum, frame: None
+            old_handler = signal.signal(signal.SIGALRM, handler)
+            signal.setitimer(signal.ITIMER_REAL, 30)
+            try:
+                self.assertRaises(self.cli_main.LockError, waiter.doLockLoop, 0.1)
+                self.failUnless(20 < signal.getitimer(signal.ITIMER_REAL)[0] <= 30)
+                self.failUnless(signal.getsignal(signal.SIGALRM) is handler)
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, old_handler)
+
+            # taken as soon as it is released, not on the next poll
+            os.write(release_write, "x")
+            waiter.doLockLoop()
+            taken = time.time()
+            released = float(os.read(locked_read, 100))
+            self.failUnless(taken - released < 1.0)
+            self.assertEqual(open(waiter.args.lockfile).read(), str(os.getpid()))
+            waiter.unlock()
+        finally:
+            os.close(release_write)
+            os.close(locked_read)
+            os.waitpid(pid, 0)
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
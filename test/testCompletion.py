@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.argparse
+        import stdcli.completion
+        self.completion = stdcli.completion
+        p = stdcli.argparse.ArgumentParser(prog="prog")
+        p.add_argument("-v", "--verbose", action="count")
+        p.add_argument("--profile", choices=["table", "json"])
+        p.add_argument("--logfile")
+        subparsers = p.add_subparsers()
+        def setup(sub):
+            sub.add_argument("--test1", action="store_true")
+            sub.add_argument("mode", choices=["fast", "slow"])
+        subparsers.add_lazy_parser("samplecmd", setup, help="sample")
+        subparsers.add_parser("other")
+        self.parser = p
+
+    def testComplete(self):
+        index = self.completion.buildIndex(self.parser)
+        complete = self.completion.complete
+        self.assertEqual(complete(index, [], ""), ["other", "samplecmd"])
+        self.assertEqual(complete(index, [], "--pr"), ["--profile"])
+        self.assertEqual(complete(index, ["--profile"], ""), ["json", "table"])
+        self.assertEqual(complete(index, [], "--profile=t"), ["--profile=table"])
+        self.assertEqual(complete(index, ["--logfile"], "sam"), [])
+        self.assertEqual(complete(index, ["--logfile", "x"], "sam"), ["samplecmd"])
+        self.assertEqual(complete(index, ["-v", "samplecmd"], "--"), ["--help", "--logfile", "--profile", "--test1", "--verbose"])
+        self.assertEqual(complete(index, ["samplecmd", "--test1"], "f"), ["fast"])
+        self.assertEqual(complete(index, ["samplecmd", "fast"], ""), [])
+
+    def testIndexFile(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, "completion.json")
+            self.assertEqual(self.completion.loadIndex(filename), None)
+            self.completion.updateIndex(self.parser, filename, "key1")
+            index = self.completion.loadIndex(filename)
+            self.assertEqual(sorted(index["commands"].keys()), ["other", "samplecmd"])
+
+            # not rewritten for the same key
+            open(filename, "a").write(" ")
+            self.completion.updateIndex(self.parser, filename, "key1")
+            self.failUnless(open(filename).read().endswith(" "))
+            self.completion.updateIndex(self.parser, filename, "key2")
+            self.failIf(open(filename).read().endswith(" "))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.config_cache
+        self.config_cache = stdcli.config_cache
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_env = dict(os.environ)
+        os.environ["STDCLI_CACHE_DIR"] = os.path.join(self.tmpdir, "cache")
+        os.environ["STDCLI_CONFIG_CACHE"] = "1"
+        self.config = os.path.join(self.tmpdir, "test.ini")
+        open(self.config, "w").write("[general]\nverbosity: 2\n\n[extra]\nname: %(__name__)s-x\n")
+        self.files = [self.config, os.path.join(self.tmpdir, "missing.ini")]
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def read(self):
+        default = StringIO("[DEFAULT]\nbase: 1\n[general]\nverbosity: 1\nlockfile: /tmp/lock\n")
+        conf = self.config_cache.readConfig([default] + self.files, "testmodule")
+        self.assertEqual(default.read(), "")
+        return conf
+
+    def items(self, conf):
+        return dict([ (s, sorted(conf.items(s))) for s in conf.sections() ])
+
+    def testReadConfig(self):
+        first = self.read()
+        self.assertEqual(first.get("general", "verbosity"), "2")
+        self.assertEqual(first.get("extra", "name"), "extra-x")
+        cached = self.read()
+        self.assertEqual(self.items(cached), self.items(first))
+        self.assertEqual(cached.defaults(), first.defaults())
+        self.failUnless(isinstance(cached.get("general", "lockfile"), str))
+
+        # a changed file is read again
+        filename = self.config_cache.cacheFile("testmodule", self.files)
+        stamp = open(filename).readline()
+        open(self.config, "w").write("[general]\nverbosity: 3\n")
+        os.utime(self.config, (time.time() + 10, time.time() + 10))
+        self.assertEqual(self.read().get("general", "verbosity"), "3")
+        self.failIf(self.read().has_section("extra"))
+        self.assertNotEqual(open(filename).readline(), stamp)
+
+    def testDisabled(self):
+        os.environ["STDCLI_CONFIG_CACHE"] = "0"
+        self.read()
+        self.failIf(os.path.exists(os.environ["STDCLI_CACHE_DIR"]))
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.entrypoints
+        self.ep = stdcli.entrypoints
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_env = os.environ.get("STDCLI_CACHE_DIR")
+        os.environ["STDCLI_CACHE_DIR"] = self.tmpdir
+
+    def tearDown(self):
+        if self.saved_env is None:
+            del(os.environ["STDCLI_CACHE_DIR"])
+        else:
+            os.environ["STDCLI_CACHE_DIR"] = self.saved_env
+        self.ep._index = None
+        shutil.rmtree(self.tmpdir)
+
+    def testCacheRoundTrip(self):
+        self.ep._index = None
+        self.assertEqual(self.ep.loadIndex(), None)
+        index = self.ep.getIndex()
+        self.failUnless(os.path.exists(self.ep.cacheFile()))
+        cached = self.ep.loadIndex()
+        self.assertEqual(cached["versions"], index["versions"])
+        self.assertEqual(sorted(cached["entry_points"].keys()), sorted(index["entry_points"].keys()))
+
+        # a changed fingerprint makes the cache stale
+        cached["fingerprint"].append(["/nonexistent", 0])
+        self.ep.saveIndex(cached)
+        self.assertEqual(self.ep.loadIndex(), None)
+
+    def testEntryPoints(self):
+        import stdcli
+        self.assertEqual(self.ep.getVersion("stdcli"), stdcli.__VERSION__)
+        self.assertRaises(self.ep.DistributionNotFound, self.ep.getVersion, "no-such-distribution-here")
+        eps = list(self.ep.iterEntryPoints("stdcli_cli_extensions", "sample"))
+        self.assertEqual(len(eps), 1)
+        import stdcli.plugins.builtin
+        self.failUnless(eps[0].load() is stdcli.plugins.builtin.SamplePlugin)
+        self.assertRaises(ImportError, self.ep.CachedEntryPoint("x", "stdcli.plugins.builtin", ["NoSuchPlugin"], "stdcli").load)
+
+    def testLazyDist(self):
+        import stdcli
+        self.assertEqual(stdcli.dist.version, stdcli.__VERSION__)
+        self.assertEqual(stdcli.dist.project_name, "stdcli")
+        self.failUnless(os.path.isdir(stdcli.dist.location))
+
+    def testLazyVersion(self):
+        import subprocess
+        import stdcli
+        self.assertEqual("v" + stdcli.__VERSION__, "v" + stdcli.dist.version)
+        self.assertEqual(str(stdcli.__VERSION__), stdcli.dist.version)
+        # the client and completer import the package: no scan, no cache
+        topdir = os.path.dirname(os.path.dirname(os.path.abspath(stdcli.__file__)))
+        env = dict(os.environ, PYTHONPATH=topdir)
+        code = "import sys, stdcli.client, stdcli.completion; sys.exit('pkg_resources' in sys.modules)"
+        self.assertEqual(subprocess.call([sys.executable, "-c", code], env=env), 0)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
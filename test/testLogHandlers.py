@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import unittest
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.trace_decorator
+        import stdcli.log_handlers
+        self.td = stdcli.trace_decorator
+        self.lh = stdcli.log_handlers
+        self.tmpdir = tempfile.mkdtemp()
+        self.trace_log = logging.getLogger("trace")
+        self.trace_log.propagate = 0
+        self.trace_log.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.trace_log.setLevel(logging.NOTSET)
+        self.td.refreshTraceEnabled()
+        shutil.rmtree(self.tmpdir)
+
+    def testJsonTraceHandler(self):
+        filename = os.path.join(self.tmpdir, "trace.jsonl")
+        hdlr = self.lh.JsonTraceHandler(filename, maxlength=10)
+        self.trace_log.addHandler(hdlr)
+        try:
+            self.td.refreshTraceEnabled()
+            decorate = self.td.traceLog()
+            def jsonTraced(a, b=None):
+                if b:
+                    raise KeyError(b)
+                return a
+            jsonTraced = decorate(jsonTraced)
+            jsonTraced("x" * 100)
+            self.assertRaises(KeyError, jsonTraced, 1, b=2)
+            logging.getLogger("trace.other").info("not a trace record")
+        finally:
+            self.trace_log.removeHandler(hdlr)
+            hdlr.close()
+
+        records = [ json.loads(line) for line in open(filename) ]
+        self.assertEqual([ r["event"] for r in records ], ["ENTER", "LEAVE"] * 2)
+        self.assertEqual(records[0]["function"], "jsonTraced")
+        self.assertEqual(records[0]["module"], __name__)
+        self.assertEqual(records[0]["args"], ["'xx...xxx'", "None"])
+        self.assertEqual(records[1]["exception"], None)
+        self.failUnless(records[1]["duration"] >= 0)
+        self.assertEqual(records[3]["exception"], "KeyError")
+        for r in records:
+            self.assertEqual(r["thread"], "MainThread")
+
+    def testQueueFullDrops(self):
+        release = threading.Event()
+        written = []
+        class Blocked(self.lh.BackgroundQueueHandler):
+            def write(self, items):
+                release.wait()
+                written.extend(items)
+        hdlr = Blocked(maxsize=2)
+        record = logging.LogRecord("x", logging.INFO, "f", 1, "msg", None, None)
+        for i in range(10):
+            hdlr.emit(record)
+        release.set()
+        hdlr.close()
+        self.assertEqual(len(written) + hdlr.dropped, 10)
+        self.failUnless(hdlr.dropped >= 7)
+
+    def testAsyncHandler(self):
+        from StringIO import StringIO
+        root = logging.getLogger("asynctest")
+        root.propagate = 0
+        root.setLevel(logging.INFO)
+        child = logging.getLogger("asynctest.child")
+        child.propagate = 0
+        out = logging.StreamHandler(StringIO())
+        out.setFormatter(logging.Formatter("%(name)s %(message)s"))
+        class ExceptionFormatter(logging.Formatter):
+            def formatException(self, exc_info):
+                return "custom %s" % exc_info[0].__name__
+        quiet = logging.StreamHandler(StringIO())
+        quiet.setLevel(logging.WARNING)
+        quiet.setFormatter(ExceptionFormatter())
+        root.addHandler(out)
+        root.addHandler(quiet)
+        child.addHandler(quiet)
+        pipeline = self.lh.makeAsync([root, child])
+        try:
+            self.assertEqual(root.handlers, [pipeline])
+            writers = []
+            out.stream.write = lambda data, write=out.stream.write: (writers.append(threading.currentThread().getName()), write(data))
+            args = ["before"]
+            root.info("one %s", args)
+            args[0] = "after"
+            child.info("not shown")
+            try:
+                raise KeyError("x")
+            except KeyError:
+                child.exception("two")
+            self.lh.flushLogs()
+        finally:
+            root.handlers = []
+            child.handlers = []
+            pipeline.close()
+
+        self.assertEqual(out.stream.getvalue(), "asynctest one ['before']\n")
+        self.assertEqual(quiet.stream.getvalue(), "two\ncustom KeyError\n")
+        self.assertEqual(writers, ["AsyncHandler writer"])
+
+    def testExitSwallowedInFinalizer(self):
+        from StringIO import StringIO
+        logger = logging.getLogger("exittest")
+        logger.propagate = 0
+        logger.addHandler(logging.StreamHandler(StringIO()))
+        pipeline = self.lh.makeAsync([logger])
+        lh = self.lh
+        class Finalized(object):
+            def __del__(self):
+                # like a signal handler running while a finalizer does
+                lh.exitWhenSafe(3)
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            Finalized()
+        finally:
+            sys.stderr = stderr
+        try:
+            try:
+                logger.warning("after")
+                self.fail("the dropped exit was not raised again")
+            except SystemExit, e:
+                self.assertEqual(e.code, 3)
+            self.lh.exitDone()
+            logger.warning("done")
+            self.lh.flushLogs()
+        finally:
+            self.lh.exitDone()
+            logger.handlers = []
+            pipeline.close()
+
+    def testLogFileHandler(self):
+        import gzip
+        filename = os.path.join(self.tmpdir, "test.log")
+        # not ours, left alone
+        others = ["test.log.1", "test.log.2.gz", "test.log.20200101", "test.log-20200101.gz"]
+        for n in others:
+            open(os.path.join(self.tmpdir, n), "w").close()
+        hdlr = self.lh.LogFileHandler(filename, buffer_size=100, flush_interval=60, max_bytes=150, backups=2, compress=True)
+        record = logging.LogRecord("x", logging.INFO, "f", 1, "%s", ("x" * 39,), None)
+        try:
+            hdlr.handle(record)
+            self.assertEqual(os.path.getsize(filename), 0)
+            self.lh.flushLogs()
+            self.assertEqual(os.path.getsize(filename), 40)
+            for i in range(40):
+                hdlr.handle(record)
+        finally:
+            hdlr.close()
+
+        self.assertEqual(hdlr.errors, 0)
+        self.failUnless(os.path.getsize(filename) <= 150)
+        rotated = sorted([ n for n in os.listdir(self.tmpdir) if n != "test.log" and n not in others ])
+        self.assertEqual(len(rotated), 2)
+        lines = 0
+        for n in rotated:
+            self.failUnless(n.endswith(".gz"))
+            content = gzip.open(os.path.join(self.tmpdir, n)).read()
+            self.failUnless(0 < len(content) <= 150)
+            lines += content.count("\n")
+        self.failUnless(lines < 40)
+        for n in others:
+            self.failUnless(os.path.exists(os.path.join(self.tmpdir, n)))
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
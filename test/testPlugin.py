@@ -0,0 +1,118 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import time
+import unittest
+
+class Context(object):
+    def __init__(self):
+        import stdcli.argparse
+        self.parser = stdcli.argparse.ArgumentParser(prog="prog")
+        self.subparsers = self.parser.add_subparsers()
+        self.order = []
+
+import stdcli.plugin
+
+class OrderedPlugin(stdcli.plugin.Plugin):
+    def __init__(self, ctx):
+        ctx.order.append(self.__class__.__name__)
+
+class LazyBase(OrderedPlugin): pass
+class LazyMiddle(OrderedPlugin): depends = ("base",)
+class LazyCommand(OrderedPlugin): depends = ("middle", "missing")
+class LazyOther(OrderedPlugin): depends = ("base",)
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.plugin
+        self.plugin = stdcli.plugin
+
+    def makePlugins(self, specs):
+        """specs: name -> (depends, seconds to sleep)"""
+        plugins = {}
+        for name, (depends, delay) in specs.items():
+            class SlowPlugin(self.plugin.Plugin):
+                def __init__(self, ctx, name=name, delay=delay):
+                    time.sleep(delay)
+                    ctx.order.append(name)
+                    p = ctx.subparsers.add_parser(name, help="%s help" % name)
+                    p.set_defaults(plugin=name)
+                    ctx.parser.add_argument("--%s-opt" % name, action="store_true")
+                    ctx.parser.add_argument_group(name).add_argument("--%s-group" % name)
+                    self.ctx = ctx
+            SlowPlugin.depends = depends
+            plugins[name] = SlowPlugin
+        container = self.plugin.PluginContainer(disable=[])
+        container.plugins["ext"] = plugins
+        return container
+
+    def testDependencyOrder(self):
+        container = self.makePlugins({"a": (["c"], 0), "b": ([], 0), "c": (["b", "missing"], 0), "d": ([], 0)})
+        self.assertEqual(container.dependencyOrder("ext"), ["b", "c", "a", "d"])
+        ctx = Context()
+        container.instantiatePlugins("ext", ctx)
+        self.assertEqual(ctx.order, ["b", "c", "a", "d"])
+
+        container = self.makePlugins({"a": (["b"], 0), "b": (["a"], 0)})
+        self.assertRaises(self.plugin.PluginDependencyError, container.dependencyOrder, "ext")
+
+    def testLazyDepends(self):
+        import stdcli.entrypoints
+        entries = [ [name, __name__, [cls], "test"] for name, cls in
+            (("base", "LazyBase"), ("middle", "LazyMiddle"), ("cmd", "LazyCommand"), ("other", "LazyOther")) ]
+        saved = stdcli.entrypoints._index
+        stdcli.entrypoints._index = {"entry_points": {"lazytest": entries}}
+        try:
+            # the plugins the command needs come along
+            container = self.plugin.PluginContainer(disable=[])
+            container.loadPlugins("lazytest", only=["cmd"])
+            self.assertEqual(sorted(container.plugins["lazytest"].keys()), ["base", "cmd", "middle"])
+            ctx = Context()
+            container.instantiatePlugins("lazytest", ctx)
+            self.assertEqual(ctx.order, ["LazyBase", "LazyMiddle", "LazyCommand"])
+
+            # disabled ones still are not
+            container = self.plugin.PluginContainer(disable=["mid*"])
+            container.loadPlugins("lazytest", only=["cmd"])
+            self.assertEqual(sorted(container.plugins["lazytest"].keys()), ["cmd"])
+        finally:
+            stdcli.entrypoints._index = saved
+
+    def testParallel(self):
+        container = self.makePlugins({"a": (["c"], 0), "b": ([], 0.2), "c": ([], 0.1), "d": ([], 0.2), "e": ([], 0.2)})
+        ctx = Context()
+        start = time.time()
+        container.instantiatePluginsParallel("ext", 4, ctx)
+        self.failUnless(time.time() - start < 0.5)
+        self.assertEqual(sorted(container.plugins["ext_instantiated"].keys()), ["a", "b", "c", "d", "e"])
+        # c before a, the rest ran at the same time
+        self.failUnless(ctx.order.index("c") < ctx.order.index("a"))
+        # subcommands are added in a fixed order, not as the threads finish
+        self.assertEqual([ a.dest for a in ctx.subparsers._choices_actions ], ["c", "a", "b", "d", "e"])
+        self.assertEqual(ctx.parser.parse_args(["e"]).plugin, "e")
+        args = ctx.parser.parse_args(["--a-o", "--b-group", "x", "--e-opt", "e"])
+        self.assertEqual((args.a_opt, args.b_group, args.c_opt, args.e_opt), (True, "x", False, True))
+
+        # a plugin that keeps its ctx can still use it
+        plugin = container.plugins["ext_instantiated"]["d"]
+        self.failUnless(isinstance(plugin.ctx, Context))
+        plugin.ctx.subparsers.add_parser("later").set_defaults(plugin="later")
+        self.assertEqual(ctx.parser.parse_args(["later"]).plugin, "later")
+
+        class Broken(self.plugin.Plugin):
+            def __init__(self, ctx):
+                raise KeyError("broken")
+        container = self.makePlugins({"a": ([], 0.1), "b": ([], 0)})
+        container.plugins["ext"]["c"] = Broken
+        self.assertRaises(KeyError, container.instantiatePluginsParallel, "ext", 2, Context())
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import time
+import signal
+import select
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+
+class FakeContext(object):
+    """the parts of BaseContext the server uses"""
+    def __init__(self):
+        import stdcli.argparse
+        self.parser = stdcli.argparse.ArgumentParser(prog="fake", add_help=False)
+        self.subparsers = self.parser.add_subparsers()
+        self.subparsers.add_lazy_parser("cmd", lambda p: None)
+        self.calls = []
+
+    def parseCommand(self, args):
+        self.args = args
+        self.calls.append(args)
+
+    def doCommands(self):
+        print "out %s" % " ".join(self.args)
+        print >> sys.stderr, "err %s %s" % (os.getcwd(), os.environ.get("FAKE_ENV"))
+        # state changed by a command stays in its child
+        if self.calls != [self.args]:
+            sys.exit(3)
+        if self.args and self.args[0] == "fail":
+            sys.exit(5)
+        if self.args and self.args[0] == "sleep":
+            print "pid %s" % os.getpid()
+            sys.stdout.flush()
+            time.sleep(10)
+
+LOGGING_CONFIG = """[general]
+verbosity: 1
+
+[formatters]
+keys: plain
+[formatter_plain]
+format: %(name)s: %(message)s
+[handlers]
+keys: err
+[handler_err]
+class: StreamHandler
+formatter: plain
+args: (sys.stderr,)
+[loggers]
+keys: root
+[logger_root]
+level: NOTSET
+handlers: err
+"""
+
+def realContext(config="[general]\nverbosity: 1\n"):
+    """
+    a BaseContext with the stdcli plugins and config as the default config.
+    meant for the forked server, should it run in the test process
+    TestCase.tearDown() restores what it patches.
+    """
+    import pkgutil
+    import stdcli.cli_main
+    pkgutil.get_data = lambda module, name: config
+    stdcli.cli_main.moduleName = "stdcli"
+    stdcli.cli_main.__VERSION__ = "0"
+    return stdcli.cli_main.BaseContext(prog="stdcli", args=["samplecmd"])
+
+class KillingOutput(object):
+    """stdout for a command that prints its pid, sends it SIGTERM"""
+    def __init__(self):
+        self.data = ""
+
+    def write(self, data):
+        self.data += data
+        for line in data.splitlines():
+            if line.startswith("pid "):
+                os.kill(int(line.split()[1]), signal.SIGTERM)
+
+    def flush(self):
+        pass
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import pkgutil
+        import stdcli.server
+        import stdcli.client
+        import stdcli.cli_main
+        self.client = stdcli.client
+        self.server = stdcli.server
+        self.cli_main = stdcli.cli_main
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, "socket")
+        self.pid = None
+        # what realContext() patches, should it run in this process
+        self.saved = (pkgutil.get_data, self.cli_main.moduleName, self.cli_main.__VERSION__)
+
+    def startServer(self, prefork=0, context=FakeContext):
+        # context() runs in the server process
+        # every process of the server holds the write end
+        self.alive, alive_write = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                os.close(self.alive)
+                os.environ["STDCLI_CACHE_DIR"] = os.path.join(self.tmpdir, "cache")
+                self.server.CommandServer(context(), self.socket_path, prefork=prefork, foreground=True).start()
+            finally:
+                os._exit(0)
+        os.close(alive_write)
+        for i in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.pid:
+            os.kill(self.pid, signal.SIGTERM)
+            os.waitpid(self.pid, 0)
+            self.failIf(os.path.exists(self.socket_path))
+            # and no worker is left behind
+            self.failUnless(select.select([self.alive], [], [], 5)[0])
+            self.assertEqual(os.read(self.alive, 1), "")
+            os.close(self.alive)
+        import pkgutil
+        pkgutil.get_data, self.cli_main.moduleName, self.cli_main.__VERSION__ = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def testRunCommand(self):
+        self.startServer()
+        self._runCommands()
+
+    def testPrefork(self):
+        self.startServer(prefork=2)
+        # more commands than workers, each worker runs one
+        for i in range(3):
+            self._runCommands()
+
+    def testRealContext(self):
+        self.startServer(context=realContext)
+        for args, output in ((["samplecmd"], "Called sampleImpl()\n"), (["-q", "samplecmd"], ""), (["samplecmd", "--test1"], "Called sampleImpl()\n")):
+            out, err = StringIO(), StringIO()
+            self.assertEqual(self.client.runCommand(self.socket_path, args, cwd=self.tmpdir, stdout=out, stderr=err), 0)
+            self.assertEqual(err.getvalue(), output)
+        out, err = StringIO(), StringIO()
+        self.assertEqual(self.client.runCommand(self.socket_path, ["--trace-profile", "table", "samplecmd"], stdout=out, stderr=err), 2)
+        self.failUnless("can only be given at startup" in err.getvalue())
+
+    def testRealContextTrace(self):
+        # logging set up again for the command keeps the loggers enabled
+        self.startServer(context=lambda: realContext(LOGGING_CONFIG))
+        out, err = StringIO(), StringIO()
+        self.assertEqual(self.client.runCommand(self.socket_path, ["samplecmd"], cwd=self.tmpdir, stdout=out, stderr=err), 0)
+        self.assertEqual(err.getvalue(), "stdcli.plugins.builtin: Called sampleImpl()\n")
+        out, err = StringIO(), StringIO()
+        self.assertEqual(self.client.runCommand(self.socket_path, ["--trace", "samplecmd"], cwd=self.tmpdir, stdout=out, stderr=err), 0)
+        self.failUnless("trace.stdcli.plugins.builtin: ENTER sampleImpl(" in err.getvalue(), err.getvalue())
+        self.failUnless("stdcli.plugins.builtin: Called sampleImpl()\n" in err.getvalue())
+
+    def testTerminate(self):
+        self.startServer()
+        out = KillingOutput()
+        self.assertEqual(self.client.runCommand(self.socket_path, ["sleep"], cwd=self.tmpdir, stdout=out, stderr=StringIO()), 128 + signal.SIGTERM)
+
+    def testTerminatePrefork(self):
+        self.startServer(prefork=2)
+        out = KillingOutput()
+        self.assertEqual(self.client.runCommand(self.socket_path, ["sleep"], cwd=self.tmpdir, stdout=out, stderr=StringIO()), 128 + signal.SIGTERM)
+        self._runCommands()
+
+    def _runCommands(self):
+        for args, code in ((["one", "two"], 0), (["fail"], 5)):
+            out, err = StringIO(), StringIO()
+            env = {"FAKE_ENV": "value"}
+            self.assertEqual(self.client.runCommand(self.socket_path, args, env=env, cwd=self.tmpdir, stdout=out, stderr=err), code)
+            self.assertEqual(out.getvalue(), "out %s\n" % " ".join(args))
+            self.assertEqual(err.getvalue(), "err %s value\n" % os.path.realpath(self.tmpdir))
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))
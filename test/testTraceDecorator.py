@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# vim:expandtab:autoindent:tabstop=4:shiftwidth=4:filetype=python:
+"""
+"""
+
+from __future__ import generators
+
+import sys
+import os
+import logging
+import unittest
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    def emit(self, record):
+        self.records.append(record)
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        import stdcli.trace_decorator
+        self.td = stdcli.trace_decorator
+        self.trace_log = logging.getLogger("trace")
+        self.trace_log.propagate = 0
+        self.trace_log.setLevel(logging.INFO)
+        self.hdlr = ListHandler()
+
+    def tearDown(self):
+        self.trace_log.removeHandler(self.hdlr)
+        self.trace_log.setLevel(logging.NOTSET)
+        self.td.refreshTraceEnabled()
+
+    def _traced(self):
+        decorate = self.td.traceLog()
+        def tracedFunc(a, b=2):
+            return a + b
+        return decorate(tracedFunc)
+
+    def testDisabledFastPath(self):
+        func = self._traced()
+        self.assertEqual(self.td.refreshTraceEnabled(), False)
+        calls = []
+        orig = self.td.format_function_call
+        self.td.format_function_call = lambda *a, **k: calls.append(a) or orig(*a, **k)
+        try:
+            self.assertEqual(func(1, b=3), 4)
+        finally:
+            self.td.format_function_call = orig
+        self.assertEqual(calls, [])
+
+    def testEnabled(self):
+        func = self._traced()
+        self.trace_log.addHandler(self.hdlr)
+        self.assertEqual(self.td.refreshTraceEnabled(), True)
+        self.assertEqual(func(1), 3)
+        messages = [r.getMessage() for r in self.hdlr.records]
+        self.assertEqual(len(messages), 2)
+        self.failUnless(messages[0].startswith("ENTER tracedFunc(1, 2)"))
+        self.failUnless(messages[1].startswith("LEAVE tracedFunc --> 3"))
+
+    def testNoTraceAndRetrace(self):
+        import types
+        mod = types.ModuleType("fake_traced_module")
+        self.td._no_trace = True
+        try:
+            exec """
+from stdcli.trace_decorator import traceLog
+@traceLog()
+def func(a):
+    return a * 2
+class Klass(object):
+    @traceLog()
+    def meth(self):
+        return 42
+""" in vars(mod)
+        finally:
+            self.td._no_trace = False
+        origFunc, origMeth = mod.func, mod.Klass.__dict__["meth"]
+        self.assertEqual(origFunc.func_code.co_filename, "<string>")
+        sys.modules[mod.__name__] = mod
+        try:
+            self.td.retraceModules("fake_traced_*")
+        finally:
+            del(sys.modules[mod.__name__])
+        self.failIf(mod.func is origFunc)
+        self.failIf(mod.Klass.__dict__["meth"] is origMeth)
+        self.trace_log.addHandler(self.hdlr)
+        self.td.refreshTraceEnabled()
+        self.assertEqual(mod.func(2), 4)
+        self.assertEqual(mod.Klass().meth(), 42)
+        self.assertEqual(len(self.hdlr.records), 4)
+
+    def testGetLogCache(self):
+        log = self.td.getLog("test.getlog.cache")
+        logger = logging.getLogger("test.getlog.cache")
+        self.assertEqual(log.info, logger.info)
+        self.failUnless("info" in vars(log))
+        # simulate logging.config.fileConfig() removing existing handlers
+        logger.removeHandler(self.td.null_handler)
+        self.td.invalidateLogCache()
+        self.assertEqual(vars(log).keys(), ["name"])
+        log.info
+        self.failUnless(self.td.null_handler in logger.handlers)
+
+    def testLazyFormatting(self):
+        reprs = []
+        class Expensive(object):
+            def __repr__(self):
+                reprs.append(1)
+                return "Expensive()"
+        decorate = self.td.traceLog()
+        def identity(x):
+            return x
+        identity = decorate(identity)
+        self.trace_log.addHandler(self.hdlr)
+        self.td.refreshTraceEnabled()
+        obj = Expensive()
+        self.failUnless(identity(obj) is obj)
+        self.assertEqual(reprs, [])
+        self.assertEqual(self.hdlr.records[0].getMessage(), "ENTER identity(Expensive())")
+        self.assertEqual(self.hdlr.records[1].getMessage(), "LEAVE identity --> Expensive()\n")
+        self.assertEqual(len(reprs), 2)
+
+    def testReprLimits(self):
+        self.td.setTraceReprLimits(maxlevel=1, maxlength=10)
+        try:
+            self.assertEqual(self.td.traceRepr([[1]]), "[[...]]")
+            self.assertEqual(self.td.traceRepr(range(100)), "[0, 1, ...")
+        finally:
+            self.td.setTraceReprLimits()
+        self.assertEqual(self.td.traceRepr([[1]]), "[[1]]")
+
+    def testSampling(self):
+        self.assertEqual(self.td.parseTraceSample("10"), (10, None))
+        self.assertEqual(self.td.parseTraceSample("5/s"), (1, 5.0))
+        self.assertEqual(self.td.parseTraceSample("10, 2.5/s"), (10, 2.5))
+        self.assertEqual(self.td.parseTraceSample(None), (1, None))
+        self.assertRaises(ValueError, self.td.parseTraceSample, "0")
+        self.assertRaises(ValueError, self.td.parseTraceSample, "fast")
+
+        func = self._traced()
+        self.trace_log.addHandler(self.hdlr)
+        self.td.refreshTraceEnabled()
+        self.td.setTraceSampling(every=3)
+        try:
+            for i in range(7):
+                self.assertEqual(func(i), i + 2)
+            # calls 0, 3 and 6 traced
+            self.assertEqual(len(self.hdlr.records), 6)
+            self.hdlr.records = []
+            self.td.setTraceSampling(rate=2)
+            for i in range(10):
+                func(i)
+            self.assertEqual(len(self.hdlr.records), 4)
+        finally:
+            self.td.setTraceSampling()
+
+    def testProfiling(self):
+        decorate = self.td.traceLog()
+        def profiledFunc(fail):
+            if fail:
+                raise ValueError(fail)
+            return fail
+        profiledFunc = decorate(profiledFunc)
+        self.td.enableProfiling()
+        try:
+            profiledFunc(0)
+            profiledFunc(0)
+            self.assertRaises(ValueError, profiledFunc, 1)
+        finally:
+            self.td.enableProfiling(False)
+        profiledFunc(0)
+        stats = [ s for s in self.td.getProfile() if s.func_name == "profiledFunc" ]
+        self.assertEqual(len(stats), 1)
+        d = stats[0].asDict()
+        self.assertEqual((d["calls"], d["exceptions"]), (3, 1))
+        self.failUnless(d["min"] <= d["p50"] <= d["max"] <= d["total"])
+        self.failUnless("profiledFunc" in self.td.formatProfile())
+        self.failUnless('"calls": 3' in self.td.formatProfile("json"))
+
+
+if __name__ == "__main__":
+    import test.TestLib
+    sys.exit(not test.TestLib.runTests( [TestCase] ))